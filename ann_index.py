@@ -0,0 +1,141 @@
+''' This module contains an approximate nearest
+neighbour index (IVF) over the GloVe vocabulary.
+
+The normalized vectors are clustered once with a spherical
+k-means; a query only scans the vectors of the 'nprobe'
+clusters whose centroids are closest to it instead of the
+whole vocabulary. The index is pure NumPy and is persisted
+next to the GloVe store.
+
+Build it ahead of time with:
+    python ann_index.py [glove store directory]
+'''
+import os
+import sys
+
+import numpy as np
+
+CENTROIDS_FILE = 'ann_centroids.npy'
+ORDER_FILE = 'ann_order.npy'
+OFFSETS_FILE = 'ann_offsets.npy'
+DEFAULT_NPROBE = int(os.environ.get('GLOVE_ANN_NPROBE', 16))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _assign(vectors, centroids, chunk_size=65536):
+    ''' Returns the closest centroid of each vector '''
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        labels[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    ''' This class holds the inverted lists of the
+    vectors (ids grouped by closest centroid)
+    '''
+
+    def __init__(self, vectors, centroids, order, offsets, nprobe=DEFAULT_NPROBE):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, vectors, nlist=None, iterations=10, sample_size=50000, seed=0):
+        ''' Clusters L2-normalized vectors into 'nlist' lists
+        (sqrt of the number of vectors by default)
+        '''
+        rng = np.random.default_rng(seed)
+        num_vectors = len(vectors)
+        nlist = nlist or max(1, int(np.sqrt(num_vectors)))
+
+        sample_ids = rng.choice(num_vectors, min(sample_size, num_vectors), replace=False)
+        sample = np.asarray(vectors[np.sort(sample_ids)], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), nlist, replace=len(sample) < nlist)]
+
+        for _ in range(iterations):
+            labels = _assign(sample, centroids)
+            counts = np.bincount(labels, minlength=nlist)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            empty = counts == 0
+
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(
+                sample[np.argsort(labels, kind='stable')], starts[~empty], axis=0)
+            # restart the empty clusters from random sample points
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = _normalize(sums).astype(np.float32)
+
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind='stable').astype(np.int32)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=nlist))))
+        return cls(vectors, centroids, order, offsets.astype(np.int64))
+
+    def save(self, directory):
+        np.save(os.path.join(directory, CENTROIDS_FILE), self.centroids)
+        np.save(os.path.join(directory, ORDER_FILE), self.order)
+        np.save(os.path.join(directory, OFFSETS_FILE), self.offsets)
+
+    @classmethod
+    def load(cls, directory, vectors, nprobe=DEFAULT_NPROBE):
+        return cls(
+            vectors,
+            np.load(os.path.join(directory, CENTROIDS_FILE)),
+            np.load(os.path.join(directory, ORDER_FILE), mmap_mode='r'),
+            np.load(os.path.join(directory, OFFSETS_FILE)),
+            nprobe,
+        )
+
+    @staticmethod
+    def exists(directory):
+        return all(os.path.isfile(os.path.join(directory, name))
+                   for name in (CENTROIDS_FILE, ORDER_FILE, OFFSETS_FILE))
+
+    def search(self, queries, k, exclude=None, nprobe=None):
+        ''' Returns the ids and cosine scores of the
+        (approximate) 'k' nearest vectors of each query,
+        best first. 'exclude' optionally gives, per query,
+        one id to leave out (the query word itself).
+        '''
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for row, query in enumerate(queries):
+            # sorted ids read the memory-mapped vectors sequentially
+            candidates = np.sort(np.concatenate(
+                [self.order[self.offsets[lst]:self.offsets[lst + 1]] for lst in probes[row]]))
+            if exclude is not None:
+                candidates = candidates[candidates != exclude[row]]
+            if not len(candidates):
+                continue
+
+            candidate_scores = np.asarray(self.vectors[candidates]) @ query
+            top = min(k, len(candidates))
+            best = np.argpartition(-candidate_scores, top - 1)[:top]
+            best = best[np.argsort(-candidate_scores[best])]
+            ids[row, :top] = candidates[best]
+            scores[row, :top] = candidate_scores[best]
+        return ids, scores
+
+
+if __name__ == '__main__':
+    import glove_store
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else glove_store.DEFAULT_STORE_DIR
+    store = glove_store.GloveStore(directory)
+    print(f"Clustering {len(store)} vectors...")
+    IVFIndex.build(store.vectors).save(directory)
+    print(f"ANN index written to {directory}")
@@ -1,14 +1,60 @@
+import json
+import multiprocessing
 import os
-from flask import Flask, render_template, redirect, url_for, request
-from werkzeug.utils import secure_filename
-from workers import generer_questions 
+import threading
+from flask import Flask, render_template, redirect, url_for, request, jsonify, abort, Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from model_registry import registry
+from quiz_cache import quiz_cache
+from quiz_sessions import quiz_sessions
+from jobs import job_queue, QueueFull
+from instrumentation import metrics, PROFILE_HEADER
+from workers import generer_questions_stream, charger_pipeline
+from uploads import (UploadRequest, UPLOAD_FOLDER, MAX_UPLOAD_BYTES, upload_slots,
+                     upload_of, remove_stale_uploads)
 
 # Constants
-UPLOAD_FOLDER = './pdf/'
+# seconds without a new question before a keep-alive is sent on /jobs/<id>/events
+EVENTS_HEARTBEAT = 15
+# 'background' loads the NLP models in a thread after startup, 'sync' before
+# serving, 'lazy' only when the first quiz is generated
+WARM_UP = os.environ.get('QUIZ_WARM_UP', 'background')
 
 # Init an app object
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+# the processes of the PDF pool (started by 'spawn') import this module
+# again when the app is run with 'python app.py': only the app itself
+# sweeps the uploads and loads the models
+IN_APP_PROCESS = multiprocessing.parent_process() is None
+
+if IN_APP_PROCESS:
+    remove_stale_uploads()
+
+# Heavy libraries (spaCy, NLTK, sklearn, PyPDF2...) are only imported
+# by the warm-up or the first quiz, so the app starts serving right away
+warm_up_state = {'finished': False, 'pipeline_error': None}
+
+
+def warm_up():
+    """ Imports the pipeline and loads the NLP models once,
+    before the first upload comes in """
+    try:
+        charger_pipeline()
+    except Exception as e:
+        warm_up_state['pipeline_error'] = str(e)
+        print(f"[WARM UP ERROR] Unable to import the pipeline: {e}")
+    registry.warm_up()
+    warm_up_state['finished'] = True
+
+
+if IN_APP_PROCESS and WARM_UP == 'sync':
+    warm_up()
+elif IN_APP_PROCESS and WARM_UP == 'background':
+    threading.Thread(target=warm_up, name='quizzet-warm-up', daemon=True).start()
 
 
 @app.route('/')
@@ -19,51 +65,222 @@ def index():
 
 @app.route('/quiz', methods=['GET', 'POST'])
 def quiz():
-    """ Handle upload and conversion of file + generate questions """
+    """ Handle upload of file + queue the generation of the questions """
 
-    UPLOAD_STATUS = False
-    questions = dict()
-
-    # Make directory to store uploaded files, if not exists
-    if not os.path.isdir('./pdf'):
-        os.mkdir('./pdf')
+    job = None
 
     if request.method == 'POST':
+        # Bound the number of uploads received at once by this process
+        if not upload_slots.acquire(blocking=False):
+            print("[FLASK ERROR] too many uploads in flight")
+            return too_busy('too many uploads in flight')
         try:
-            # Retrieve file from request
+            # Retrieve file from request, already written in a unique
+            # file of UPLOAD_FOLDER while the request was read
             uploaded_file = request.files['file']
-            file_path = os.path.join(
-                app.config['UPLOAD_FOLDER'],
-                secure_filename(uploaded_file.filename)
-            )
+            upload = upload_of(uploaded_file)
             file_exten = uploaded_file.filename.rsplit('.', 1)[1].lower()
+            upload.flush()
+
+            # Opt-in cProfile/tracemalloc profile of this upload
+            profile = PROFILE_HEADER and request.headers.get('X-Quiz-Profile') == '1'
 
-            # Save uploaded file
-            uploaded_file.save(file_path)
+            # The questions are generated by a background worker, and
+            # streamed on /jobs/<id>/events as they are ready; the file
+            # is removed once they are
+            job = job_queue.submit(generer_questions_stream, upload.path, file_exten,
+                                   profile=profile, digest=upload.hexdigest(),
+                                   supprimer_fichier=True)
+            upload.handed_over = True
+            # Keep the answer key of the quiz for /result
+            job.add_done_callback(save_quiz_session)
 
-            # Utilise la fonction fusionnée
-            questions = generer_questions(file_path, file_exten)
+        except QueueFull as e:
+            print(f"[FLASK ERROR] job queue full: {e}")
+            return too_busy('job queue full')
 
-            if questions:
-                UPLOAD_STATUS = True
+        except RequestEntityTooLarge:
+            raise
 
         except Exception as e:
             print(f"[FLASK ERROR] no file entered")
 
+        finally:
+            upload_slots.release()
+
+    if job and request.accept_mimetypes.best == 'application/json':
+        return jsonify(job.to_dict()), 202
+
+    return render_template(
+        'quiz.html',
+        uploaded=False,
+        job_id=job.id if job else None
+    )
+
+
+def too_busy(reason):
+    """ Upload refused because the server is busy """
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'error': reason}), 429
+    return render_template('quiz.html', uploaded=False, busy=True), 429
+
+
+def save_quiz_session(job):
+    """ Stores the answer key of a generated quiz under its job id """
+    if job.status == 'done':
+        quiz_sessions.save(job.id, job.result)
+
+
+@app.teardown_request
+def remove_uploads(exc):
+    """ Removes the uploaded files no job took """
+    request.remove_uploads()
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """ Upload bigger than MAX_CONTENT_LENGTH """
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'error': 'file too large', 'max_bytes': MAX_UPLOAD_BYTES}), 413
+    return render_template('quiz.html', uploaded=False, too_large=True,
+                           max_megabytes=MAX_UPLOAD_BYTES // (1024 * 1024)), 413
+
+
+@app.route('/quiz/<job_id>')
+def quiz_result(job_id):
+    """ The quiz generated by a job, or a waiting page while it runs """
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+
+    if not job.finished:
+        return render_template('quiz.html', uploaded=False, job_id=job.id)
+
+    questions = job.result or dict()
     return render_template(
         'quiz.html',
-        uploaded=UPLOAD_STATUS,
+        uploaded=bool(questions),
         questions=questions,
-        size=len(questions)
+        size=len(questions),
+        quiz_id=job.id
     )
 
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """ Status and timings of a quiz generation job """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """ Server-sent events: each question of a job as soon as it is
+    generated, then the final status of the job """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+
+    def events():
+        for item in job.iter_items(heartbeat=EVENTS_HEARTBEAT):
+            if item is None:
+                yield ': keep-alive\n\n'
+                continue
+            number, question = item
+            yield f"event: question\ndata: {json.dumps({'number': number, **question})}\n\n"
+        yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/jobs')
+def jobs():
+    """ Depth and activity of the job queue """
+    return jsonify(job_queue.stats())
+
+
+@app.route('/health')
+def health():
+    """ Liveness: the app answers, whether the models are loaded or not """
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/ready')
+def ready():
+    """ Readiness: 200 once the pipeline and every model are loaded, 503 before.
+    With QUIZ_WARM_UP=lazy the models are loaded by the first quiz, so the
+    app is always ready """
+    is_ready = WARM_UP == 'lazy' or (
+        warm_up_state['finished'] and warm_up_state['pipeline_error'] is None
+        and registry.is_ready())
+    body = {
+        'ready': is_ready,
+        'warm_up': WARM_UP,
+        'warm_up_finished': warm_up_state['finished'],
+        'models': registry.status(),
+    }
+    if warm_up_state['pipeline_error']:
+        body['pipeline_error'] = warm_up_state['pipeline_error']
+    return jsonify(body), 200 if is_ready else 503
+
+
+@app.route('/models')
+def models():
+    """ Load time and memory of the shared NLP models """
+    return jsonify(registry.stats())
+
+
+@app.route('/cache')
+def cache():
+    """ Hit/miss counters of the generated quizzes cache """
+    return jsonify(quiz_cache.stats())
+
+
+@app.route('/sessions')
+def sessions():
+    """ Stored quizzes and grading counters """
+    return jsonify(quiz_sessions.stats())
+
+
+@app.route('/corpus')
+def corpus():
+    """ Documents and terms of the corpus used to score the uploads """
+    # imported here: corpus imports sklearn, loaded by the warm-up
+    from corpus import corpus_statistics
+    if corpus_statistics is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(corpus_statistics.stats(), enabled=True))
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """ Pipeline stage timings, cache and job queue in Prometheus text format """
+    lines = [metrics.render_prometheus()]
+
+    cache_stats = quiz_cache.stats()
+    lines.append('# TYPE quizzet_cache_requests_total counter')
+    lines.append(f'quizzet_cache_requests_total{{result="hit"}} {cache_stats["hits"]}')
+    lines.append(f'quizzet_cache_requests_total{{result="miss"}} {cache_stats["misses"]}')
+
+    job_stats = job_queue.stats()
+    lines.append('# TYPE quizzet_jobs gauge')
+    lines.append(f'quizzet_jobs{{state="queued"}} {job_stats["queued"]}')
+    lines.append(f'quizzet_jobs{{state="running"}} {job_stats["running"]}')
+
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/result', methods=['POST', 'GET'])
 def result():
-    correct_q = 0
-    for k, v in request.form.items():
-        correct_q += 1
-    return render_template('result.html', total=5, correct=correct_q)
+    """ Grades the submitted answers against the stored answer key of the quiz """
+    graded = quiz_sessions.grade(request.form.get('quiz_id'), request.form)
+    if graded is None:
+        return render_template('result.html', expired=True)
+    correct_q, total = graded
+    return render_template('result.html', total=total, correct=correct_q)
 
 
 if __name__ == "__main__":
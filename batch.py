@@ -0,0 +1,55 @@
+"""
+Module batch.py — Génération de quiz pour tout un ensemble de documents
+
+Usage:
+    python batch.py cours/ extra.pdf --output quizzes.jsonl --n-process 4 --workers 4
+
+Chaque ligne du fichier JSONL produit contient le chemin du document et ses questions.
+"""
+import argparse
+import json
+import sys
+import time
+
+from question_generation_main import QuestionGeneration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate quizzes for many PDF/TXT documents at once")
+    parser.add_argument('inputs', nargs='+', help="files and/or directories")
+    parser.add_argument('--output', default='quizzes.jsonl', help="JSONL file to write")
+    parser.add_argument('--questions', type=int, default=8, help="questions per quiz")
+    parser.add_argument('--options', type=int, default=5, help="options per question")
+    parser.add_argument('--batch-size', type=int, default=4, help="text chunks per spaCy batch")
+    parser.add_argument('--n-process', type=int, default=1, help="spaCy processes")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes for the stages after NER (TF-IDF, ranking, distractors)")
+    parser.add_argument('--corpus', help="SQLite corpus (see corpus.py) whose IDF scores the words")
+    args = parser.parse_args(argv)
+
+    corpus = None
+    if args.corpus:
+        from corpus import CorpusStatistics
+        corpus = CorpusStatistics(args.corpus)
+    qGen = QuestionGeneration(args.questions, args.options, corpus)
+
+    start = time.perf_counter()
+    num_documents = 0
+    with open(args.output, 'w', encoding='utf-8') as output:
+        for path, questions in qGen.generate_questions_from_files(
+                args.inputs, args.batch_size, args.n_process, args.workers):
+            output.write(json.dumps({'file': path, 'questions': questions},
+                                    ensure_ascii=False) + '\n')
+            num_documents += 1
+            print(f"[BATCH] {path}: {len(questions)} questions")
+
+    elapsed = time.perf_counter() - start
+    rate = num_documents / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"[BATCH] {num_documents} documents in {elapsed:.1f}s ({rate:.1f} docs/minute)"
+          f" -> {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""Benchmarks of the question generation pipeline.
+
+Run them from the root of the repository, e.g.:
+    python -m benchmarks.tfidf
+"""
+import time
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from question_extraction import QuestionExtractor
+from question_generation_main import QuestionGeneration
+
+
+class Vectors:
+    """The two KeyedVectors attributes read by glove_store.build_store."""
+
+    def __init__(self, index_to_key, vectors):
+        self.index_to_key = index_to_key
+        self.vectors = vectors
+
+
+def best_time(func, repeat):
+    """Best wall time of 'repeat' calls of func."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def question_extractor(num_questions=10, stop_words=frozenset(), corpus=None):
+    """A QuestionExtractor with the attributes set by its constructor,
+    without loading the NLTK stop words."""
+    extractor = QuestionExtractor.__new__(QuestionExtractor)
+    extractor.num_questions = num_questions
+    extractor.corpus = corpus
+    extractor.stop_words = stop_words
+    extractor.vectorizer = TfidfVectorizer()
+    extractor.questions_dict = dict()
+    return extractor
+
+
+def question_generation(num_questions=10, num_options=4, stop_words=frozenset(), corpus=None):
+    """A QuestionGeneration built on question_extractor()."""
+    generation = QuestionGeneration.__new__(QuestionGeneration)
+    generation.num_questions = num_questions
+    generation.num_options = num_options
+    generation.question_extractor = question_extractor(num_questions, stop_words, corpus)
+    generation.questions_dict = dict()
+    return generation
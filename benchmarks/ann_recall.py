@@ -0,0 +1,76 @@
+"""Recall and latency of the IVF index (ann_index.py) against exact
+search, for all the answers of a quiz queried in one batch.
+
+    python -m benchmarks.ann_recall [--store models/glove-wiki-gigaword-100]
+
+Without a GloVe store, synthetic clustered vectors of the same shape
+are written to a temporary store (--vectors, --dim).
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import glove_store
+from ann_index import IVFIndex
+from benchmarks import Vectors
+
+
+def synthetic_vectors(num_vectors, dim, num_topics=2000, seed=0):
+    """Normalized vectors drawn around random topic directions,
+    to mimic the cluster structure of word embeddings."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((num_topics, dim)).astype(np.float32)
+    vectors = topics[rng.integers(num_topics, size=num_vectors)]
+    vectors += 0.8 * rng.standard_normal((num_vectors, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def run(store, num_queries, k, nprobes):
+    rng = np.random.default_rng(1)
+    query_ids = rng.choice(len(store.vectors), num_queries, replace=False)
+    queries = np.asarray(store.vectors[query_ids])
+
+    start = time.perf_counter()
+    index = IVFIndex.build(store.vectors)
+    print(f"{len(store.vectors)} vectors, {len(index.centroids)} lists, "
+          f"built in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    exact_ids, _ = store.exact_search(queries, k, exclude=query_ids)
+    exact_s = time.perf_counter() - start
+    print(f"{'search':>12} {'batch ms':>9} {'recall@' + str(k):>10}")
+    print(f"{'exact':>12} {exact_s * 1000:>9.1f} {1.0:>10.3f}")
+
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        ids, _ = index.search(queries, k, exclude=query_ids, nprobe=nprobe)
+        elapsed = time.perf_counter() - start
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, exact_ids)])
+        print(f"{'nprobe=' + str(nprobe):>12} {elapsed * 1000:>9.1f} {recall:>10.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--store', help="GloVe store directory")
+    parser.add_argument('--vectors', type=int, default=400000)
+    parser.add_argument('--dim', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=128, help="answers per batch")
+    parser.add_argument('--k', type=int, default=15)
+    parser.add_argument('--nprobe', nargs='+', type=int, default=[4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    if args.store:
+        run(glove_store.GloveStore(args.store), args.queries, args.k, args.nprobe)
+    else:
+        directory = tempfile.mkdtemp(prefix='quizzet-ann-')
+        try:
+            vectors = synthetic_vectors(args.vectors, args.dim)
+            words = [f"w{i}" for i in range(len(vectors))]
+            store_dir = glove_store.build_store(Vectors(words, vectors), os.path.join(directory, 'store'))
+            run(glove_store.GloveStore(store_dir), args.queries, args.k, args.nprobe)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,88 @@
+"""Benchmark of QuestionGeneration.clean_text on multi-MB documents,
+against the former implementation (string concatenation and slicing
+per sentence), with a randomized check that both give the same output.
+
+    python -m benchmarks.clean_text [--sizes 1 2 4 8] [--checks 2000] [--repeat 3]
+
+--sizes are in MB. The time per MB of clean_text should stay flat.
+"""
+import argparse
+import random
+import re
+
+from nltk import sent_tokenize
+
+from benchmarks import best_time, question_generation
+
+# words, punctuation kept or removed by clean_text, spaces and newlines
+ALPHABET = ['word', 'Paris', 'été', '42', '.', '?', '!', ',', ';', ':', '(', ')',
+            '"', "'", '-', '@', '#', '€', ' ', ' ', '  ', '\t', '\n', '\n\n']
+
+
+def legacy_clean_text(text):
+    """The clean_text replaced by the linear-time implementation."""
+    text = text.replace('\n', ' ')
+    sentences = sent_tokenize(text)
+    cleaned_text = ""
+
+    for sentence in sentences:
+        cleaned_sentence = re.sub(r'[^\s\w\.\?\!\,\;\:]', '', sentence)
+        cleaned_sentence = re.sub(' +', ' ', cleaned_sentence)
+        cleaned_text += cleaned_sentence
+
+        if cleaned_text.endswith(' '):
+            cleaned_text = cleaned_text[:-1] + '.'
+        else:
+            cleaned_text += '.'
+
+        cleaned_text += ' '
+
+    return cleaned_text.strip()
+
+
+def random_text(rng, max_tokens):
+    return ''.join(rng.choice(ALPHABET) + rng.choice(['', ' '])
+                   for _ in range(rng.randrange(max_tokens)))
+
+
+def check(num_checks, seed=0):
+    """Compares both implementations on random texts."""
+    rng = random.Random(seed)
+    generation = question_generation()
+    for _ in range(num_checks):
+        text = random_text(rng, 200)
+        expected = legacy_clean_text(text)
+        assert generation.clean_text(text) == expected, f"clean_text differs on {text!r}"
+
+
+def document(megabytes, seed=0):
+    rng = random.Random(seed)
+    sentences = []
+    size = 0
+    while size < megabytes * 2**20:
+        sentence = random_text(rng, 40) + rng.choice(['.', '?', '!', '...']) + ' '
+        sentences.append(sentence)
+        size += len(sentence)
+    return ''.join(sentences)
+
+
+def run(sizes, repeat):
+    generation = question_generation()
+    print(f"{'MB':>4} {'legacy s':>9} {'linear s':>9} {'legacy s/MB':>11} {'linear s/MB':>11}")
+    for megabytes in sizes:
+        text = document(megabytes)
+        legacy_s = best_time(lambda: legacy_clean_text(text), repeat)
+        linear_s = best_time(lambda: generation.clean_text(text), repeat)
+        print(f"{megabytes:>4} {legacy_s:>9.3f} {linear_s:>9.3f} "
+              f"{legacy_s / megabytes:>11.3f} {linear_s / megabytes:>11.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1, 2, 4, 8])
+    parser.add_argument('--checks', type=int, default=2000, help="random equality checks")
+    parser.add_argument('--repeat', type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+    check(args.checks)
+    print(f"clean_text identical to the former implementation on {args.checks} random texts")
+    run(args.sizes, args.repeat)
@@ -0,0 +1,106 @@
+"""Corpus mode of the TF-IDF scoring (corpus.py): streaming fit of
+a corpus of synthetic documents, and scoring of an upload against it
+compared with the TfidfVectorizer fitted on the upload.
+
+    python -m benchmarks.corpus [--documents 10000] [--words 1000]
+                                [--vocab 100000] [--upload 2000x8000]
+
+The fit reports the time (without generating the documents) and the
+Python peak memory, which stays bounded by the blocks written to
+SQLite. Before timing, a corpus whose documents are the sentences of
+the upload is checked to score exactly like the TfidfVectorizer.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from benchmarks import best_time
+from benchmarks.tfidf import parse_size, synthetic_sentences
+from corpus import CorpusStatistics
+
+
+def synthetic_documents(num_documents, words_per_document, vocab_size, seed=0):
+    """(key, text) of documents drawn from a Zipf-like vocabulary, one at a time."""
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"word{i}" for i in range(vocab_size)])
+    weights = 1.0 / np.arange(1, vocab_size + 1)
+    weights /= weights.sum()
+    for i in range(num_documents):
+        words = vocab[rng.choice(vocab_size, words_per_document, p=weights)]
+        yield f"doc{i}", ' '.join(words.tolist())
+
+
+def check_equivalence(directory, sentences):
+    corpus = CorpusStatistics(os.path.join(directory, 'sentences.sqlite'))
+    corpus.add_documents((f"sentence{i}", sentence) for i, sentence in enumerate(sentences))
+
+    vectorizer = TfidfVectorizer()
+    expected = vectorizer.fit_transform(sentences)
+    tf_idf_vector, feature_names = corpus.transform(sentences)
+    assert list(feature_names) == list(vectorizer.get_feature_names_out())
+    assert abs(tf_idf_vector - expected).max() < 1e-12, \
+        "the corpus IDF differs from the TfidfVectorizer one"
+
+
+def run(num_documents, words_per_document, vocab_size, upload_size, repeat):
+    directory = tempfile.mkdtemp(prefix='quizzet-corpus-')
+    try:
+        sentences = synthetic_sentences(*upload_size)
+        check_equivalence(directory, sentences)
+
+        def documents():
+            return synthetic_documents(num_documents, words_per_document, vocab_size)
+
+        start = time.perf_counter()
+        for _ in documents():
+            pass
+        generate_s = time.perf_counter() - start
+
+        # timed without tracemalloc, then measured again in another corpus
+        path = os.path.join(directory, 'corpus.sqlite')
+        corpus = CorpusStatistics(path)
+        start = time.perf_counter()
+        added = corpus.add_documents(documents())
+        fit_s = time.perf_counter() - start - generate_s
+
+        tracemalloc.start()
+        CorpusStatistics(os.path.join(directory, 'memory.sqlite')).add_documents(documents())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        stats = corpus.stats()
+        print(f"fit: {added} documents of {words_per_document} words in {fit_s:.1f}s "
+              f"(+{generate_s:.1f}s to generate them), {stats['terms']} terms, "
+              f"peak {peak / 2**20:.1f} MB (Python), file {os.path.getsize(path) / 2**20:.1f} MB")
+
+        # a second pass adds nothing: the documents are keyed
+        assert corpus.add_documents(synthetic_documents(10, words_per_document, vocab_size)) == 0
+
+        start = time.perf_counter()
+        corpus.add_document('upload', ' '.join(sentences))
+        update_s = time.perf_counter() - start
+
+        refit_s = best_time(lambda: TfidfVectorizer().fit_transform(sentences), repeat)
+        transform_s = best_time(lambda: corpus.transform(sentences), repeat)
+        print(f"upload {upload_size[0]}x{upload_size[1]}: corpus update {update_s * 1e3:.1f} ms, "
+              f"TfidfVectorizer fit {refit_s * 1e3:.1f} ms, corpus transform {transform_s * 1e3:.1f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=10000)
+    parser.add_argument('--words', type=int, default=1000, help="words per document")
+    parser.add_argument('--vocab', type=int, default=100000)
+    parser.add_argument('--upload', type=parse_size, default=(2000, 8000),
+                        help="SENTENCESxVOCABULARY of the scored upload")
+    parser.add_argument('--repeat', type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+    run(args.documents, args.words, args.vocab, args.upload, args.repeat)
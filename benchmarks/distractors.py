@@ -0,0 +1,191 @@
+"""Latency of the distractor stage (IncorrectAnswerGenerator) for
+quizzes of 8, 32 and 128 questions: answers resolved one after another
+as before, against all of them resolved at once by prefetch_options.
+The build time and memory of the document vectors are also reported.
+
+The web path (QuestionGeneration.iter_questions, streamed to /quiz)
+is measured too: one prefetch_options per question as before, against
+the first question resolved alone and the others in one batch.
+
+    python -m benchmarks.distractors [--questions 8 32 128] [--doc-words 20000]
+                                     [--glove-vocab 100000] [--repeat 5]
+
+A random GloVe store is built in a temporary directory. A third of
+the answers are single known words (batched model query), the others
+are multi-word or unknown answers ranked against the document words.
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import glove_store
+from benchmarks import Vectors, best_time, question_generation
+from incorrect_answer_generation import IncorrectAnswerGenerator
+from model_registry import registry
+from preprocessing import PreprocessedDocument
+from question_generation_main import QuestionGeneration
+
+
+class LegacyVocabulary:
+    """The former per-document matrix, built with one model lookup per word."""
+
+    def __init__(self, model, words):
+        self.model = model
+        self.words = words
+        rows, vectors = [], []
+        for idx, word in enumerate(words):
+            key = word.lower()
+            if key in model:
+                rows.append(idx)
+                vectors.append(model.get_vector(key))
+        matrix = np.array(vectors, dtype=np.float32).reshape(len(rows), model.vectors.shape[1])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.rows = np.array(rows, dtype=np.intp)
+        self.matrix = matrix / norms
+
+    def answer_vector(self, answer):
+        vectors = [self.model.get_vector(w) for w in answer.lower().split() if w in self.model]
+        if not vectors:
+            return None
+        vector = np.mean(np.array(vectors, dtype=np.float32), axis=0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def closest_document_words(self, answer, topn):
+        """The per-answer lookup replaced by get_closest_document_words_batch."""
+        scores = np.zeros(len(self.words), dtype=np.float32)
+        answer_vector = self.answer_vector(answer)
+        if answer_vector is not None and len(self.rows):
+            scores[self.rows] = self.matrix @ answer_vector
+        answer = answer.lower()
+        contained = np.fromiter((word.lower() in answer for word in self.words),
+                                dtype=bool, count=len(self.words))
+        scores[contained] = -1.0
+        topn = min(topn, len(scores))
+        best = np.argpartition(-scores, topn - 1)[:topn]
+        best = best[np.argsort(-scores[best])]
+        return [self.words[idx] for idx in best]
+
+
+def legacy_options(generator, answers, num_options):
+    generator.prefetch_similar_words(answers)
+    generator.get_closest_document_words = generator.legacy.closest_document_words
+    return [generator.get_all_options_dict(answer, num_options) for answer in answers]
+
+
+def batched_options(generator, answers, num_options):
+    generator.prefetch_options(answers, num_options)
+    return [generator.get_all_options_dict(answer, num_options) for answer in answers]
+
+
+def streamed_legacy_options(generation, document, questions):
+    """The former QuestionGeneration.iter_questions: one prefetch per question."""
+    generation.incorrect_answer_generator = IncorrectAnswerGenerator(document)
+    for number, question in questions:
+        generation.incorrect_answer_generator.prefetch_options(
+            [question["answer"]], generation.num_options)
+        question["options"] = generation.get_options(number, question["answer"])
+        yield number, question
+
+
+def streamed_options(resolve, generation, document, answers):
+    questions = ((i, {"answer": answer}) for i, answer in enumerate(answers, 1))
+    return list(resolve(generation, document, questions))
+
+
+def make_answers(num_questions, glove_words, doc_words, seed=0):
+    rng = random.Random(seed)
+    answers = []
+    for i in range(num_questions):
+        kind = i % 3
+        if kind == 0:
+            answers.append(rng.choice(glove_words))
+        elif kind == 1:
+            answers.append(' '.join(rng.sample(doc_words, 2)).title())
+        else:
+            answers.append(f"Unknown{i} Entity{i}")
+    return answers
+
+
+def run(question_counts, num_doc_words, glove_vocab, num_options, repeat):
+    rng = np.random.default_rng(0)
+    glove_words = [f"w{i}" for i in range(glove_vocab)]
+    # half of the document words are known by the model
+    doc_words = glove_words[:num_doc_words // 2] + [f"doc{i}" for i in range(num_doc_words // 2)]
+
+    directory = tempfile.mkdtemp(prefix='quizzet-distractors-')
+    try:
+        vectors = rng.standard_normal((glove_vocab, 100), dtype=np.float32)
+        glove_store.build_store(Vectors(glove_words, vectors), directory)
+        store = glove_store.GloveStore(directory)
+        registry.register('glove', lambda: store)
+
+        document = PreprocessedDocument.__new__(PreprocessedDocument)
+        document.vocab = doc_words
+        generator = IncorrectAnswerGenerator(document)
+        closest_document_words = generator.get_closest_document_words
+
+        # the vectors of the document are built once per document in both cases
+        start = time.perf_counter()
+        generator.legacy = LegacyVocabulary(store, doc_words)
+        legacy_build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        generator.build_vocab_matrix()
+        build_s = time.perf_counter() - start
+        print(f"{len(doc_words)} document words: former matrix built in {legacy_build_s * 1e3:.1f} ms, "
+              f"DocumentEmbeddings in {build_s * 1e3:.1f} ms "
+              f"({generator.embeddings.nbytes() / 2**20:.1f} MB)")
+
+        def options(resolve, answers):
+            generator.similar_words_cache = dict()
+            generator.closest_words_cache = dict()
+            generator.embeddings.phrase_vectors = dict()
+            generator.get_closest_document_words = closest_document_words
+            return resolve(generator, answers, num_options)
+
+        print(f"{'questions':>9} {'former ms':>10} {'batched ms':>10} {'speedup':>7}")
+        for num_questions in question_counts:
+            answers = make_answers(num_questions, glove_words, doc_words)
+
+            # same document words, in any order: the matrix and vector products
+            # round differently, and the unknown answers score 0 everywhere (ties)
+            known = [answer for answer in answers if not answer.startswith('Unknown')]
+            batched = generator.get_closest_document_words_batch(known, num_options)
+            assert all(set(words) == set(generator.legacy.closest_document_words(answer, num_options))
+                       for answer, words in zip(known, batched)), \
+                "the batched lookup changed the distractors"
+
+            former_s = best_time(lambda: options(legacy_options, answers), repeat)
+            batched_s = best_time(lambda: options(batched_options, answers), repeat)
+            print(f"{num_questions:>9} {former_s * 1e3:>10.1f} {batched_s * 1e3:>10.1f} "
+                  f"{former_s / batched_s:>7.1f}")
+
+        # web path: the document vectors are built by each streamed quiz
+        generation = question_generation(num_options=num_options)
+        print(f"streamed: {'questions':>9} {'former ms':>10} {'batched ms':>10} {'speedup':>7}")
+        for num_questions in question_counts:
+            answers = make_answers(num_questions, glove_words, doc_words)
+            former_s = best_time(lambda: streamed_options(
+                streamed_legacy_options, generation, document, answers), repeat)
+            batched_s = best_time(lambda: streamed_options(
+                QuestionGeneration.iter_options, generation, document, answers), repeat)
+            print(f"          {num_questions:>9} {former_s * 1e3:>10.1f} {batched_s * 1e3:>10.1f} "
+                  f"{former_s / batched_s:>7.1f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', nargs='+', type=int, default=[8, 32, 128])
+    parser.add_argument('--doc-words', type=int, default=20000)
+    parser.add_argument('--glove-vocab', type=int, default=100000)
+    parser.add_argument('--options', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+    run(args.questions, args.doc_words, args.glove_vocab, args.options, args.repeat)
@@ -0,0 +1,140 @@
+"""Benchmark of the ranking of QuestionExtractor (rank_keywords +
+form_questions) on synthetic documents with a growing number of
+candidate entities, against the former substring-based sentence
+lookup and the former full sort of the candidates.
+
+    python -m benchmarks.ranking [--candidates 250 1000 4000 16000]
+                                 [--questions 8] [--repeat 5]
+
+With the heap, only the sentences of the candidates popped until
+--questions questions are formed are looked up ('form ms', flat in
+the number of candidates); every candidate is still tokenized, scored
+and pushed on the heap ('rank us/c'). That per-candidate cost is
+constant work (a few dict lookups, heapify is linear) but is not flat
+in wall time: the word_score dict and the candidate lists of large
+documents no longer fit in the CPU caches, so each lookup gets slower.
+"""
+import argparse
+import random
+import time
+
+from nltk.tokenize import word_tokenize
+
+from benchmarks import best_time, question_extractor
+
+STOP_WORDS = {'the', 'a', 'an', 'of', 'in', 'is', 'was', 'and', 'to', 'by'}
+
+
+def synthetic_document(num_candidates, sentences_per_candidate=2, seed=0):
+    """A document where each candidate entity appears in a few sentences."""
+    rng = random.Random(seed)
+    filler = [f"term{i}" for i in range(5000)]
+    candidates = [f"Entity{i} Name{i % 97}" for i in range(num_candidates)]
+    sentences = []
+    for candidate in candidates:
+        for _ in range(sentences_per_candidate):
+            words = rng.sample(filler, 12)
+            words.insert(rng.randrange(len(words)), candidate)
+            sentences.append(' '.join(words) + '.')
+    rng.shuffle(sentences)
+    return ' '.join(sentences), candidates
+
+
+def legacy_sentence_for_keyword(extractor, keyword):
+    """The lookup replaced in get_corresponding_sentence_for_keyword."""
+    words = word_tokenize(keyword.lower())
+    for word in words:
+        row = extractor.sentence_id_for_max_word_score.get(word)
+        if row is None:  # formerly mapped to "", which never matches
+            continue
+        sentence = extractor.unfiltered_sentences[row]
+        if all(w.lower() in sentence.lower() for w in words):
+            return sentence
+    return ""
+
+
+def legacy_rank_keywords(extractor):
+    triples = []
+    for keyword in extractor.candidate_keywords:
+        sentence = legacy_sentence_for_keyword(extractor, keyword)
+        if sentence:
+            triples.append([extractor.get_keyword_score(keyword), keyword, sentence])
+    triples.sort(reverse=True)
+    return triples
+
+
+def sorted_rank_keywords(extractor):
+    """The former rank_keywords: indexed lookup of the sentence
+    of every candidate, then a full sort."""
+    triples = []
+    for keyword in extractor.candidate_keywords:
+        words = word_tokenize(keyword.lower())
+        sentence = extractor.get_corresponding_sentence_for_keyword(keyword, words)
+        if sentence:
+            triples.append([extractor.get_keyword_score(keyword, words), keyword, sentence])
+    triples.sort(reverse=True)
+    return triples
+
+
+def form_from_triples(extractor, rank):
+    extractor.questions_dict = dict()
+    extractor.candidate_heap = []
+    extractor.candidate_triples = rank(extractor)
+    extractor.form_questions()
+    return extractor.questions_dict
+
+
+def form_from_heap(extractor):
+    extractor.questions_dict = dict()
+    extractor.rank_keywords()
+    extractor.form_questions()
+    return extractor.questions_dict
+
+
+def form_time(extractor, ranked_heap, repeat):
+    """Best time of form_questions alone, each run on a fresh copy of the ranked heap."""
+    best = float('inf')
+    for _ in range(repeat):
+        extractor.questions_dict = dict()
+        extractor.candidate_triples = []
+        extractor.candidate_heap = list(ranked_heap)
+        start = time.perf_counter()
+        extractor.form_questions()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(candidate_counts, num_questions, repeat):
+    print(f"{'candidates':>10} {'sentences':>9} {'legacy s':>9} {'sorted s':>9} "
+          f"{'heap s':>9} {'sorted us/c':>11} {'heap us/c':>9} {'speedup':>7} "
+          f"{'rank us/c':>9} {'form ms':>7}")
+    for num_candidates in candidate_counts:
+        document, candidates = synthetic_document(num_candidates)
+
+        extractor = question_extractor(num_questions, STOP_WORDS)
+        extractor.set_tfidf_scores(document)
+        extractor.candidate_keywords = candidates
+
+        expected = form_from_triples(extractor, sorted_rank_keywords)
+        assert form_from_heap(extractor) == expected, "the heap changed the questions"
+
+        legacy_s = best_time(lambda: form_from_triples(extractor, legacy_rank_keywords), repeat)
+        sorted_s = best_time(lambda: form_from_triples(extractor, sorted_rank_keywords), repeat)
+        heap_s = best_time(lambda: form_from_heap(extractor), repeat)
+        rank_s = best_time(extractor.rank_keywords, repeat)
+        form_s = form_time(extractor, list(extractor.candidate_heap), repeat)
+
+        print(f"{num_candidates:>10} {len(extractor.unfiltered_sentences):>9} "
+              f"{legacy_s:>9.3f} {sorted_s:>9.3f} {heap_s:>9.3f} "
+              f"{sorted_s / num_candidates * 1e6:>11.1f} {heap_s / num_candidates * 1e6:>9.1f} "
+              f"{sorted_s / heap_s:>7.1f} {rank_s / num_candidates * 1e6:>9.2f} {form_s * 1e3:>7.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--candidates', nargs='+', type=int,
+                        default=[250, 1000, 4000, 16000])
+    parser.add_argument('--questions', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+    run(args.candidates, args.questions, args.repeat)
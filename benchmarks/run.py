@@ -0,0 +1,392 @@
+"""Benchmark harness of the whole question generation pipeline.
+
+Each document (synthetic, or built from the bundled samples of
+benchmarks/samples) is generated at graded sizes, then every stage is
+timed in isolation (clean_text, tokenize, ner, tfidf, ranking,
+distractors) and the pipeline is run end to end (workers.generer_questions
+without the quiz cache). Times are the best of --repeat runs; the peak
+memory of each stage is measured in a separate run under tracemalloc.
+
+    python -m benchmarks.run [--pages 1 10 50 100 500] [--sources synthetic samples]
+                             [--documents file.pdf ...] [--repeat 3]
+                             [--models auto|real|stand-in] [--output run.json]
+                             [--compare previous.json]
+
+The results are saved as JSON (./benchmarks/results/ by default) and
+--compare prints the time ratio of every stage against a previous run.
+
+When the spaCy or GloVe models are not installed (--models auto), small
+local stand-ins are registered in the model registry instead: a blank
+spaCy pipeline whose entity ruler knows the entities of the benchmark
+documents, and a random GloVe store holding the document vocabulary
+padded to --glove-vocab words. Stand-in timings only compare runs made
+with the same stand-ins.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# the end-to-end runs must not be answered by the quiz cache
+os.environ['QUIZ_CACHE_BACKEND'] = 'none'
+
+import numpy as np
+
+import glove_store
+import workers
+from benchmarks import Vectors
+from incorrect_answer_generation import IncorrectAnswerGenerator
+from instrumentation import trace_pipeline
+from model_registry import SPACY_MODELS, registry
+from preprocessing import PreprocessedDocument
+from question_generation_main import QuestionGeneration
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), 'samples')
+RESULTS_DIR = os.path.join('.', 'benchmarks', 'results')
+PAGE_CHARS = 3000  # characters of text in a typical PDF page
+STAGES = ('clean_text', 'tokenize', 'ner', 'tfidf', 'ranking', 'distractors')
+
+FIRST_NAMES = ['Ada', 'Alan', 'Grace', 'Marie', 'Isaac', 'Emmy', 'Niels', 'Rosalind',
+               'Carl', 'Lise', 'Henri', 'Sofia', 'Pierre', 'Hedy', 'Enrico', 'Dorothy']
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'vo', 'sul', 'dor', 'pe', 'an',
+             'gri', 'mo', 'chel', 'ta', 'ber', 'nu', 'wen', 'ox', 'lis', 'far']
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+
+
+def _pseudo_word(rng, syllables):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+def synthetic_entities(count, seed=0):
+    """(label, text) pairs of made-up entities of the kinds kept by
+    QuestionExtractor.filter_entities."""
+    rng = random.Random(seed)
+    entities = dict()
+    while len(entities) < count:
+        kind = rng.randrange(4)
+        if kind == 0:
+            text = f"{rng.choice(FIRST_NAMES)} {_pseudo_word(rng, 3).capitalize()}"
+            label = 'PERSON'
+        elif kind == 1:
+            text = _pseudo_word(rng, 3).capitalize() + rng.choice(['ville', 'burg', 'ton'])
+            label = 'GPE'
+        elif kind == 2:
+            text = f"{_pseudo_word(rng, 2).capitalize()} {rng.choice(['Institute', 'Society', 'Company'])}"
+            label = 'ORG'
+        else:
+            text = f"{rng.choice(MONTHS)} {rng.randrange(1500, 2030)}"
+            label = 'DATE'
+        entities[text] = label
+    return [(label, text) for text, label in entities.items()]
+
+
+def synthetic_document(pages, seed=0):
+    """A document of about 'pages' pages of sentences made of a Zipf-like
+    pseudo-word vocabulary, with a few entities in most sentences."""
+    rng = random.Random(seed)
+    vocab = [_pseudo_word(rng, rng.randrange(1, 4)) for _ in range(5000)]
+    weights = [1.0 / (rank + 1) for rank in range(len(vocab))]
+    entities = [text for _, text in synthetic_entities(20 * pages, seed)]
+
+    sentences = []
+    size = 0
+    while size < pages * PAGE_CHARS:
+        words = rng.choices(vocab, weights, k=rng.randrange(8, 25))
+        for _ in range(rng.randrange(3)):
+            words.insert(rng.randrange(len(words)), rng.choice(entities))
+        sentence = ' '.join(words) + '.'
+        sentence = sentence[0].upper() + sentence[1:]
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    # paragraphs of about ten sentences
+    return '\n\n'.join(' '.join(sentences[i:i + 10]) for i in range(0, len(sentences), 10))
+
+
+def sample_document(pages):
+    """The bundled sample texts repeated up to about 'pages' pages."""
+    texts = []
+    for name in sorted(os.listdir(SAMPLES_DIR)):
+        if name.endswith('.txt'):
+            with open(os.path.join(SAMPLES_DIR, name), encoding='utf-8') as sample:
+                texts.append(sample.read().strip())
+    parts = []
+    size = 0
+    while size < pages * PAGE_CHARS:
+        text = texts[len(parts) % len(texts)]
+        parts.append(text)
+        size += len(text) + 2
+    return '\n\n'.join(parts)
+
+
+def sample_entities():
+    with open(os.path.join(SAMPLES_DIR, 'entities.tsv'), encoding='utf-8') as tsv:
+        return [tuple(line.rstrip('\n').split('\t')) for line in tsv if line.strip()]
+
+
+def spacy_model_installed():
+    import spacy
+
+    return any(spacy.util.is_package(name) for name in SPACY_MODELS)
+
+
+def stand_in_spacy(entities):
+    """A blank English pipeline tagging the given (label, text) entities."""
+    def load():
+        import spacy
+
+        nlp = spacy.blank('en')
+        if int(spacy.__version__.split('.')[0]) < 3:
+            # spaCy 2 (requirements.txt) adds component instances
+            from spacy.pipeline import EntityRuler
+
+            ruler = EntityRuler(nlp)
+            nlp.add_pipe(ruler)
+        else:
+            ruler = nlp.add_pipe('entity_ruler')
+        ruler.add_patterns([{'label': label, 'pattern': text} for label, text in entities])
+        return nlp
+    return load
+
+
+def stand_in_glove(documents, vocab_size, directory, dim=100, seed=0):
+    """A GloVe store of random vectors over the words of the documents,
+    padded with filler words up to 'vocab_size' words."""
+    def load():
+        words = dict.fromkeys(
+            word.strip('.,;:!?').lower() for text in documents for word in text.split())
+        words.pop('', None)
+        words = list(words)
+        words += [f"filler{i}" for i in range(max(0, vocab_size - len(words)))]
+        vectors = np.random.default_rng(seed).standard_normal((len(words), dim), dtype=np.float32)
+        glove_store.build_store(Vectors(words, vectors), directory)
+        return glove_store.GloveStore(directory)
+    return load
+
+
+def measure(func, repeat):
+    """Returns the result of func, its best time over 'repeat' runs
+    and its peak traced memory (one more run under tracemalloc)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, {'seconds': round(best, 6), 'peak_memory_bytes': peak}
+
+
+def benchmark_stages(raw_text, num_questions, num_options, repeat):
+    """Times each stage of the pipeline on its own, fed with
+    the output of the previous one."""
+    generation = QuestionGeneration(num_questions, num_options)
+    extractor = generation.question_extractor
+    stages = dict()
+
+    text, stages['clean_text'] = measure(lambda: generation.clean_text(raw_text), repeat)
+    document, stages['tokenize'] = measure(
+        lambda: PreprocessedDocument(text, extractor.stop_words), repeat)
+    entities, stages['ner'] = measure(lambda: extractor.get_candidate_entities(document), repeat)
+    _, stages['tfidf'] = measure(lambda: extractor.set_tfidf_scores(document), repeat)
+
+    def ranking():
+        extractor.questions_dict = dict()
+        extractor.candidate_keywords = entities
+        extractor.rank_keywords()
+        extractor.form_questions()
+        return extractor.questions_dict
+    questions, stages['ranking'] = measure(ranking, repeat)
+
+    def distractors():
+        generator = IncorrectAnswerGenerator(document)
+        generator.prefetch_options([q['answer'] for q in questions.values()], num_options)
+        return [generator.get_all_options_dict(q['answer'], num_options)
+                for q in questions.values()]
+    _, stages['distractors'] = measure(distractors, repeat)
+
+    counts = {
+        'sentences': len(document.sentences),
+        'tokens': sum(len(words) for words in document.tokens),
+        'entities': len(entities),
+        'questions': len(questions),
+    }
+    return stages, counts
+
+
+def benchmark_end_to_end(file_path, num_questions, num_options, repeat):
+    """Times workers.generer_questions on a file, with the
+    breakdown of the stages recorded by its trace."""
+    file_exten = file_path.rsplit('.', 1)[1]
+    traces = []
+
+    def generate():
+        with trace_pipeline('benchmark') as trace:
+            questions = workers._generer_questions(file_path, file_exten, num_questions, num_options)
+        traces.append(trace)
+        return questions
+
+    questions, end_to_end = measure(generate, repeat)
+    # stage times of the fastest timed run (the last trace ran under tracemalloc)
+    fastest = min(traces[:-1] or traces,
+                  key=lambda trace: next(s['wall_seconds'] for s in trace.stages if s['stage'] == 'total'))
+    end_to_end['stages'] = {s['stage']: round(s['wall_seconds'], 6)
+                            for s in fastest.stages if s['stage'] != 'total'}
+    end_to_end['annotations'] = dict(fastest.annotations)
+    end_to_end['questions'] = len(questions)
+    return end_to_end
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def iter_documents(sources, pages, paths):
+    """Yields (name, source, text) for every benchmark document."""
+    for source in sources:
+        for num_pages in pages:
+            if source == 'synthetic':
+                yield f"synthetic-{num_pages}p", source, synthetic_document(num_pages)
+            else:
+                yield f"samples-{num_pages}p", source, sample_document(num_pages)
+    for path in paths:
+        yield os.path.basename(path), 'file', None
+
+
+def run(args):
+    documents = list(iter_documents(args.sources, args.pages, args.documents))
+    tmp_dir = tempfile.mkdtemp(prefix='quizzet-bench-')
+
+    models = {'spacy': 'real', 'glove': 'real'}
+    if args.models == 'stand-in' or (args.models == 'auto' and not spacy_model_installed()):
+        entities = sample_entities() + synthetic_entities(20 * max(args.pages))
+        registry.register('spacy', stand_in_spacy(entities))
+        models['spacy'] = 'stand-in'
+    if args.models == 'stand-in' or (args.models == 'auto' and not glove_store.store_exists()):
+        texts = [text for _, _, text in documents if text is not None]
+        registry.register('glove', stand_in_glove(
+            texts, args.glove_vocab, os.path.join(tmp_dir, 'glove')))
+        models['glove'] = 'stand-in'
+    print(f"Models: spaCy {models['spacy']}, GloVe {models['glove']}")
+    registry.warm_up()
+
+    print_result(None)
+    results = []
+    try:
+        for name, source, text in documents:
+            if text is None:
+                file_path = next(path for path in args.documents if os.path.basename(path) == name)
+                text = workers.lire_document(file_path, file_path.rsplit('.', 1)[1])
+            else:
+                file_path = os.path.join(tmp_dir, f"{name}.txt")
+                with open(file_path, 'w', encoding='utf-8') as document_file:
+                    document_file.write(text)
+
+            stages, counts = benchmark_stages(text, args.questions, args.options, args.repeat)
+            end_to_end = benchmark_end_to_end(file_path, args.questions, args.options, args.repeat)
+            results.append({
+                'document': name,
+                'source': source,
+                'pages': round(len(text) / PAGE_CHARS, 1),
+                'chars': len(text),
+                **counts,
+                'stages': stages,
+                'end_to_end': end_to_end,
+            })
+            print_result(results[-1])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'models': models,
+            'model_stats': registry.stats(),
+            'repeat': args.repeat,
+            'questions': args.questions,
+            'options': args.options,
+            # ru_maxrss is in KB on Linux
+            'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        },
+        'results': results,
+    }
+
+
+def print_result(result):
+    if result is None:
+        print(f"{'document':<18} {'pages':>6} " +
+              ' '.join(f"{stage:>11}" for stage in STAGES) + f" {'end-to-end':>11} {'peak MB':>8}")
+        return
+    stages = result['stages']
+    peak = max(stage['peak_memory_bytes'] for stage in stages.values())
+    print(f"{result['document']:<18} {result['pages']:>6} " +
+          ' '.join(f"{stages[stage]['seconds']:>11.4f}" for stage in STAGES) +
+          f" {result['end_to_end']['seconds']:>11.4f} {peak / 2**20:>8.1f}")
+
+
+def compare(current, previous_path):
+    """Prints the time ratio (current / previous) of each stage
+    of the documents present in both runs."""
+    with open(previous_path, encoding='utf-8') as previous_file:
+        previous = {r['document']: r for r in json.load(previous_file)['results']}
+
+    print(f"\nTime ratio against {previous_path} (< 1 is faster):")
+    print(f"{'document':<18} " + ' '.join(f"{stage:>11}" for stage in STAGES) + f" {'end-to-end':>11}")
+    for result in current['results']:
+        old = previous.get(result['document'])
+        if old is None:
+            continue
+        ratios = [result['stages'][stage]['seconds'] / max(old['stages'][stage]['seconds'], 1e-9)
+                  for stage in STAGES]
+        ratios.append(result['end_to_end']['seconds'] / max(old['end_to_end']['seconds'], 1e-9))
+        print(f"{result['document']:<18} " + ' '.join(f"{ratio:>11.2f}" for ratio in ratios))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', nargs='+', type=int, default=[1, 10, 50, 100, 500])
+    parser.add_argument('--sources', nargs='+', choices=['synthetic', 'samples'],
+                        default=['synthetic', 'samples'])
+    parser.add_argument('--documents', nargs='*', default=[], help="extra PDF/TXT files")
+    parser.add_argument('--repeat', type=int, default=3, help="best of N runs")
+    parser.add_argument('--questions', type=int, default=8)
+    parser.add_argument('--options', type=int, default=5)
+    parser.add_argument('--models', choices=['auto', 'real', 'stand-in'], default='auto')
+    parser.add_argument('--glove-vocab', type=int, default=100000,
+                        help="vocabulary size of the stand-in GloVe store")
+    parser.add_argument('--output', help="JSON results file")
+    parser.add_argument('--compare', help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    report = run(args)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"run-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
@@ -0,0 +1,114 @@
+"""Benchmark of QuestionExtractor.score_tfidf_matrix against
+the former dense implementation (todense().tolist() + double loop)
+on synthetic documents.
+
+    python -m benchmarks.tfidf [--sizes 500x2000 2000x8000 5000x20000]
+
+Sizes are SENTENCESxVOCABULARY. The dense version is skipped when the
+matrix has more than --dense-limit cells.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from benchmarks import question_extractor
+
+
+def synthetic_sentences(num_sentences, vocab_size, words_per_sentence=20, seed=0):
+    """Sentences of words drawn from a Zipf-like vocabulary."""
+    rng = random.Random(seed)
+    vocab = [f"word{i}" for i in range(vocab_size)]
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+    # every word appears at least once so the vocabulary has the requested size
+    sentences = [' '.join(vocab[i:i + words_per_sentence])
+                 for i in range(0, vocab_size, words_per_sentence)]
+    while len(sentences) < num_sentences:
+        sentences.append(' '.join(rng.choices(vocab, weights, k=words_per_sentence)))
+    return sentences[:num_sentences]
+
+
+def dense_scores(tf_idf_vector, feature_names, sentences):
+    """The implementation replaced in set_tfidf_scores."""
+    word_score = dict()
+    sentence_for_max_word_score = dict()
+    tf_idf_matrix = tf_idf_vector.todense().tolist()
+    num_sentences = len(sentences)
+
+    for i in range(len(feature_names)):
+        word = feature_names[i]
+        sentence_for_max_word_score[word] = ""
+        tot = 0.0
+        cur_max = 0.0
+        for j in range(num_sentences):
+            if j < len(tf_idf_matrix):
+                tot += tf_idf_matrix[j][i]
+                if tf_idf_matrix[j][i] > cur_max:
+                    cur_max = tf_idf_matrix[j][i]
+                    sentence_for_max_word_score[word] = sentences[j]
+        word_score[word] = tot / num_sentences if num_sentences > 0 else 0
+    return word_score, sentence_for_max_word_score
+
+
+def sentence_for_max_word_score(extractor, feature_names, sentences):
+    """The former (word, sentence where word score is max) dict, derived
+    from sentence_id_for_max_word_score ("" when the word never scores)."""
+    return {word: sentences[extractor.sentence_id_for_max_word_score[word]]
+            if word in extractor.sentence_id_for_max_word_score else ""
+            for word in feature_names}
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run(sizes, dense_limit):
+    extractor = question_extractor()
+
+    print(f"{'size':>12} {'nnz':>9} {'dense s':>9} {'dense MB':>9} "
+          f"{'sparse s':>9} {'sparse MB':>9}")
+    for num_sentences, vocab_size in sizes:
+        sentences = synthetic_sentences(num_sentences, vocab_size)
+        vectorizer = TfidfVectorizer()
+        tf_idf_vector = vectorizer.fit_transform(sentences)
+        feature_names = vectorizer.get_feature_names_out()
+
+        def sparse():
+            extractor.score_tfidf_matrix(tf_idf_vector, feature_names, sentences)
+            return extractor.word_score, extractor.sentence_id_for_max_word_score
+
+        sparse_result, sparse_s, sparse_peak = measure(sparse)
+
+        dense_col = f"{'-':>9} {'-':>9}"
+        if tf_idf_vector.shape[0] * tf_idf_vector.shape[1] <= dense_limit:
+            dense_result, dense_s, dense_peak = measure(
+                dense_scores, tf_idf_vector, feature_names, sentences)
+            assert dense_result[1] == sentence_for_max_word_score(extractor, feature_names, sentences)
+            assert all(abs(dense_result[0][w] - sparse_result[0][w]) < 1e-9
+                       for w in dense_result[0])
+            dense_col = f"{dense_s:>9.3f} {dense_peak / 2**20:>9.1f}"
+
+        print(f"{num_sentences:>5}x{vocab_size:<6} {tf_idf_vector.nnz:>9} {dense_col} "
+              f"{sparse_s:>9.3f} {sparse_peak / 2**20:>9.1f}")
+
+
+def parse_size(text):
+    num_sentences, vocab_size = text.lower().split('x')
+    return int(num_sentences), int(vocab_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=parse_size,
+                        default=[(500, 2000), (2000, 8000), (5000, 20000)])
+    parser.add_argument('--dense-limit', type=int, default=20_000_000)
+    args = parser.parse_args()
+    run(args.sizes, args.dense_limit)
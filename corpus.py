@@ -0,0 +1,228 @@
+''' This module contains the corpus mode of the TF-IDF
+scoring: the document frequencies of a whole course corpus,
+kept on disk and updated one document at a time.
+
+Without a corpus, QuestionExtractor fits a TfidfVectorizer
+on the sentences of each upload. With one, the words of an
+upload are weighted by their IDF over the corpus (the words
+common to every course of the domain score low), which only
+needs the document frequencies of the words of the upload:
+nothing is refitted.
+
+    python corpus.py courses/ extra.pdf [--path ./cache/corpus.sqlite]
+
+adds documents to the corpus, streaming: the terms are
+counted by blocks of documents written to SQLite, so the
+memory does not grow with the size of the corpus. A document
+is keyed by the sha256 of its file and is only counted once.
+'''
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+# unset: the IDF is computed on the sentences of each upload
+CORPUS_PATH = os.environ.get('QUIZ_CORPUS_PATH')
+# '1': the uploads are added to the corpus before being scored
+CORPUS_UPDATE = os.environ.get('QUIZ_CORPUS_UPDATE', '1') == '1'
+# pending documents and distinct terms written at once
+FLUSH_DOCUMENTS = 1000
+FLUSH_TERMS = 200000
+# terms per query, below the SQLite limit of bound parameters
+TERMS_PER_QUERY = 500
+
+
+class CorpusStatistics:
+    ''' This class contains the document frequency of each
+    term of a corpus, stored in a SQLite file shared by
+    every worker process
+    '''
+
+    def __init__(self, path=CORPUS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # same tokens as the TfidfVectorizer of QuestionExtractor
+        self.analyzer = CountVectorizer().build_analyzer()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS terms ('
+                ' term TEXT PRIMARY KEY,'
+                ' df INTEGER NOT NULL)')
+
+    def document_terms(self, text):
+        ''' Returns the set of terms of a document, tokenized
+        like the sentences scored by QuestionExtractor
+        '''
+        # imported here: question_generation_main imports the whole pipeline
+        from question_generation_main import UNWANTED_CHARS
+        return set(self.analyzer(UNWANTED_CHARS.sub('', text)))
+
+    def add_document(self, key, text):
+        ''' Adds a document to the corpus.
+        Returns False if it was already counted
+        '''
+        return self.add_documents([(key, text)]) == 1
+
+    def add_documents(self, documents, flush_documents=FLUSH_DOCUMENTS,
+                      flush_terms=FLUSH_TERMS):
+        ''' Adds documents to the corpus, written by blocks of at most
+        'flush_documents' documents or 'flush_terms' distinct terms
+
+        Params:
+            * documents : iterable of (key, text)
+        Returns:
+            * int : number of documents added (not already counted)
+        '''
+        added = 0
+        pending = []  # (key, set of terms)
+        num_terms = 0
+        for key, text in documents:
+            terms = self.document_terms(text)
+            pending.append((key, terms))
+            num_terms += len(terms)
+            if len(pending) >= flush_documents or num_terms >= flush_terms:
+                added += self._write(pending)
+                pending = []
+                num_terms = 0
+        if pending:
+            added += self._write(pending)
+        return added
+
+    def _write(self, documents):
+        ''' Counts the terms of the documents not counted yet,
+        in one transaction '''
+        counts = Counter()
+        added = 0
+        with self._lock, self._conn:
+            for key, terms in documents:
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO documents VALUES (?)', (key,))
+                if cursor.rowcount == 1:
+                    counts.update(terms)
+                    added += 1
+            self._conn.executemany(
+                'INSERT INTO terms VALUES (?, ?)'
+                ' ON CONFLICT (term) DO UPDATE SET df = df + excluded.df',
+                counts.items())
+        return added
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT 1 FROM documents WHERE key = ?', (key,)).fetchone() is not None
+
+    @property
+    def num_documents(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def document_frequencies(self, terms):
+        ''' Returns the document frequency of each term (0 if unknown) '''
+        terms = list(terms)
+        position = {term: i for i, term in enumerate(terms)}
+        df = np.zeros(len(terms))
+        with self._lock:
+            for start in range(0, len(terms), TERMS_PER_QUERY):
+                chunk = terms[start:start + TERMS_PER_QUERY]
+                rows = self._conn.execute(
+                    'SELECT term, df FROM terms WHERE term IN (%s)' % ','.join('?' * len(chunk)),
+                    chunk)
+                for term, count in rows:
+                    df[position[term]] = count
+        return df
+
+    def idf(self, terms):
+        ''' Returns the smoothed IDF of each term over the
+        corpus, as computed by TfidfVectorizer
+        '''
+        num_documents = self.num_documents
+        df = self.document_frequencies(terms)
+        return np.log((1 + num_documents) / (1 + df)) + 1
+
+    def transform(self, sentences):
+        ''' Returns the TF-IDF matrix (sentences x words) of the
+        sentences of a document, weighted by the IDF of the corpus,
+        and the word of each column
+
+        Params:
+            * sentences : list<str>
+        Returns:
+            * (scipy CSR matrix, list<str>)
+        '''
+        # only counts the words of the document: the statistics come from the corpus
+        counter = CountVectorizer(dtype=np.float64)
+        tf_idf_vector = counter.fit_transform(sentences)
+        try:
+            feature_names = counter.get_feature_names_out()
+        except AttributeError:
+            feature_names = counter.get_feature_names()
+
+        tf_idf_vector.data *= self.idf(feature_names)[tf_idf_vector.indices]
+        return normalize(tf_idf_vector, copy=False), feature_names
+
+    def stats(self):
+        with self._lock:
+            num_documents = self._conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+            num_terms = self._conn.execute('SELECT COUNT(*) FROM terms').fetchone()[0]
+        return {
+            'path': self.path,
+            'documents': num_documents,
+            'terms': num_terms,
+            'update': CORPUS_UPDATE,
+        }
+
+
+def open_corpus(path=CORPUS_PATH):
+    ''' Opens the corpus selected by QUIZ_CORPUS_PATH,
+    or returns None when corpus mode is off
+    '''
+    return CorpusStatistics(path) if path else None
+
+
+corpus_statistics = open_corpus()
+
+
+def main(argv=None):
+    from question_generation_main import iter_document_paths
+    from quiz_cache import file_digest
+    from workers import lire_document
+
+    parser = argparse.ArgumentParser(
+        description="Add PDF/TXT documents to the corpus used to score the uploads")
+    parser.add_argument('inputs', nargs='+', help="files and/or directories")
+    parser.add_argument('--path', default=CORPUS_PATH or os.path.join('.', 'cache', 'corpus.sqlite'),
+                        help="SQLite file of the corpus")
+    args = parser.parse_args(argv)
+
+    corpus = CorpusStatistics(args.path)
+
+    def read_documents():
+        for path in iter_document_paths(args.inputs):
+            key = file_digest(path)
+            if key not in corpus:  # not read again
+                yield key, lire_document(path, path.rsplit('.', 1)[1])
+
+    start = time.perf_counter()
+    added = corpus.add_documents(read_documents())
+    stats = corpus.stats()
+    print(f"[CORPUS] {added} documents added in {time.perf_counter() - start:.1f}s: "
+          f"{stats['documents']} documents, {stats['terms']} terms -> {args.path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
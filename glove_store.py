@@ -0,0 +1,175 @@
+''' This module contains the on-disk, memory-mapped
+store of the GloVe vectors.
+
+The vectors are converted once into a float32 NumPy array
+(L2-normalized, so a dot product is a cosine similarity)
+plus a vocabulary file. Every worker process maps the array
+read-only, so the page cache holds a single copy of it.
+
+Build the store ahead of time with:
+    python glove_store.py [directory]
+'''
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from ann_index import IVFIndex
+
+VECTORS_FILE = 'vectors.npy'
+VOCAB_FILE = 'vocab.txt'
+DEFAULT_STORE_DIR = os.environ.get(
+    'GLOVE_STORE_DIR', os.path.join('.', 'models', 'glove-wiki-gigaword-100'))
+# answer similar_by_words queries with the ANN index when it has been built
+USE_ANN = os.environ.get('GLOVE_ANN', '0') == '1'
+
+
+class GloveStore:
+    ''' This class exposes the subset of the gensim
+    KeyedVectors interface used by IncorrectAnswerGenerator
+    on top of the memory-mapped vectors
+    '''
+
+    def __init__(self, directory=DEFAULT_STORE_DIR):
+        self.directory = directory
+        self.vectors = np.load(
+            os.path.join(directory, VECTORS_FILE), mmap_mode='r')
+        with open(os.path.join(directory, VOCAB_FILE), encoding='utf-8') as vocab_file:
+            self.index_to_key = vocab_file.read().split('\n')
+        self.key_to_index = {word: idx for idx, word in enumerate(self.index_to_key)}
+
+        # optional approximate nearest neighbour index (see ann_index.py)
+        self.ann = None
+        if USE_ANN and IVFIndex.exists(directory):
+            self.ann = IVFIndex.load(directory, self.vectors)
+
+    def __contains__(self, word):
+        return word in self.key_to_index
+
+    def __len__(self):
+        return len(self.index_to_key)
+
+    def get_vector(self, word):
+        ''' Returns the (normalized) vector of a word,
+        raises KeyError for an unknown word
+        '''
+        try:
+            return self.vectors[self.key_to_index[word]]
+        except KeyError:
+            raise KeyError(f"Key '{word}' not present") from None
+
+    def similarity(self, word1, word2):
+        ''' Returns the cosine similarity between two words '''
+        return float(np.dot(self.get_vector(word1), self.get_vector(word2)))
+
+    def similar_by_word(self, word, topn=10):
+        ''' Returns the 'topn' (word, similarity) pairs
+        closest to a word, most similar first
+        '''
+        word_idx = self.key_to_index.get(word)
+        if word_idx is None:
+            raise KeyError(f"Key '{word}' not present")
+
+        sims = self.vectors @ self.vectors[word_idx]
+        sims[word_idx] = -np.inf
+
+        topn = min(topn, len(sims) - 1)
+        best = np.argpartition(-sims, topn)[:topn]
+        best = best[np.argsort(-sims[best])]
+        return [(self.index_to_key[idx], float(sims[idx])) for idx in best]
+
+    def exact_search(self, queries, k, exclude=None, block_size=32):
+        ''' Returns the ids and cosine scores of the 'k'
+        nearest vectors of each (normalized) query, best first.
+        The queries are multiplied with the whole vocabulary by
+        blocks, to bound the size of the similarity matrix.
+        '''
+        queries = np.atleast_2d(queries)
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), block_size):
+            stop = start + block_size
+            sims = queries[start:stop] @ self.vectors.T
+            if exclude is not None:
+                sims[np.arange(len(sims)), exclude[start:stop]] = -np.inf
+            best = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(sims, best, axis=1)
+            rank = np.argsort(-best_scores, axis=1)
+            ids[start:stop] = np.take_along_axis(best, rank, axis=1)
+            scores[start:stop] = np.take_along_axis(best_scores, rank, axis=1)
+        return ids, scores
+
+    def similar_by_words(self, words, topn=10):
+        ''' Batched similar_by_word: returns, for each word,
+        its 'topn' (word, similarity) pairs, or None when the
+        word is unknown. Uses the ANN index when it is enabled.
+        '''
+        word_ids = [self.key_to_index.get(word) for word in words]
+        known = [i for i, word_id in enumerate(word_ids) if word_id is not None]
+        results = [None] * len(words)
+        if not known:
+            return results
+
+        query_ids = np.array([word_ids[i] for i in known])
+        queries = np.asarray(self.vectors[query_ids])
+        topn = min(topn, len(self) - 1)
+
+        if self.ann is not None:
+            ids, scores = self.ann.search(queries, topn, exclude=query_ids)
+        else:
+            ids, scores = self.exact_search(queries, topn, exclude=query_ids)
+
+        for row, i in enumerate(known):
+            results[i] = [(self.index_to_key[idx], float(score))
+                          for idx, score in zip(ids[row], scores[row]) if idx >= 0]
+        return results
+
+
+def store_exists(directory=DEFAULT_STORE_DIR):
+    return (os.path.isfile(os.path.join(directory, VECTORS_FILE)) and
+            os.path.isfile(os.path.join(directory, VOCAB_FILE)))
+
+
+def build_store(keyed_vectors, directory=DEFAULT_STORE_DIR):
+    ''' Writes gensim KeyedVectors to 'directory' as a
+    normalized float32 array and a vocabulary file.
+    The store is written to a temporary directory and renamed
+    into place, so concurrent builders never see a partial store.
+    '''
+    # gensim >= 4 renamed index2word to index_to_key
+    words = getattr(keyed_vectors, 'index_to_key', None)
+    if words is None:
+        words = keyed_vectors.index2word
+
+    vectors = np.asarray(keyed_vectors.vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent)
+    try:
+        np.save(os.path.join(tmp_dir, VECTORS_FILE), vectors / norms)
+        with open(os.path.join(tmp_dir, VOCAB_FILE), 'w', encoding='utf-8') as vocab_file:
+            vocab_file.write('\n'.join(words))
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # another process built the store in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not store_exists(directory):
+            raise
+    return directory
+
+
+if __name__ == '__main__':
+    import gensim.downloader as api
+    from model_registry import GLOVE_MODEL
+
+    target = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_STORE_DIR
+    if store_exists(target):
+        print(f"GloVe store already present in {target}")
+    else:
+        build_store(api.load(GLOVE_MODEL), target)
+        print(f"GloVe store written to {target}")
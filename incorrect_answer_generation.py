@@ -2,13 +2,145 @@
 for generating incorrect alternative
 answers for a given answer
 '''
-import gensim
-import gensim.downloader as api
-from gensim.models import Word2Vec
+from concurrent.futures import ThreadPoolExecutor
 from nltk.tokenize import sent_tokenize, word_tokenize
+import os
 import random
+import threading
 import numpy as np
 
+from instrumentation import annotate
+from model_registry import registry
+from preprocessing import PreprocessedDocument
+
+# threads computing the blocks of the answers x vocabulary
+# similarity matrix (NumPy releases the GIL)
+DISTRACTOR_WORKERS = int(os.environ.get('QUIZ_DISTRACTOR_WORKERS', min(4, os.cpu_count() or 1)))
+DISTRACTOR_BLOCK = 16
+
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+
+
+def distractor_thread_pool():
+    ''' Returns the thread pool shared by every generator '''
+    global _thread_pool
+    with _thread_pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(DISTRACTOR_WORKERS,
+                                              thread_name_prefix='distractors')
+    return _thread_pool
+
+
+def lookup_vectors(model, keys):
+    ''' Returns the positions of the keys known by the
+    model and their vectors, gathered in one indexing
+    '''
+    key_to_index = getattr(model, 'key_to_index', None)
+    if key_to_index is not None:
+        positions, ids = [], []
+        for position, key in enumerate(keys):
+            idx = key_to_index.get(key)
+            if idx is not None:
+                positions.append(position)
+                ids.append(idx)
+        vectors = np.asarray(model.vectors[np.array(ids, dtype=np.intp)], dtype=np.float32)
+    else:
+        # gensim 3 KeyedVectors
+        positions = [position for position, key in enumerate(keys) if key in model]
+        vectors = np.array([model.get_vector(keys[p]) for p in positions], dtype=np.float32)
+    dim = model.vectors.shape[1]
+    return np.array(positions, dtype=np.intp), vectors.reshape(len(positions), dim)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class DocumentEmbeddings:
+    ''' This class holds the vectors of the words of a
+    document, built once per document: the position of the
+    words known by the model, a contiguous matrix of their
+    normalized vectors, the mask of the words usable as
+    distractors and the vectors of the answers (phrases)
+    '''
+
+    def __init__(self, model, words, stop_words=()):
+        self.model = model
+        self.words = words
+        keys = [word.lower() for word in words]
+
+        self.rows, vectors = lookup_vectors(model, keys)
+        self.matrix = np.ascontiguousarray(normalize_rows(vectors), dtype=np.float32)
+
+        # stop words and punctuation only come after the other words
+        self.candidate_mask = np.fromiter(
+            (key not in stop_words and any(c.isalnum() for c in key) for key in keys),
+            dtype=bool, count=len(keys))
+
+        # lowercase key -> indices of its words ('Paris' and 'paris'),
+        # compared with the lowercased answer like the similarities
+        self.word_ids = dict()
+        for idx, key in enumerate(keys):
+            self.word_ids.setdefault(key, []).append(idx)
+        # only the first spelling of a key can be a distractor
+        self.unique_mask = np.zeros(len(keys), dtype=bool)
+        self.unique_mask[[ids[0] for ids in self.word_ids.values()]] = True
+        self.max_word_length = max(map(len, keys), default=0)
+        self.phrase_vectors = dict()  # answer -> normalized vector, or None
+
+    def get_phrase_vectors(self, answers):
+        ''' Returns the matrix of the normalized mean vectors
+        of the words of the answers (zero for an answer with no
+        known word). The vectors are computed once per answer.
+        '''
+        pending = [a for a in dict.fromkeys(answers) if a not in self.phrase_vectors]
+        if pending:
+            keys, owners = [], []
+            for owner, answer in enumerate(pending):
+                words = answer.lower().split()
+                keys.extend(words)
+                owners.extend([owner] * len(words))
+            positions, vectors = lookup_vectors(self.model, keys)
+            owners = np.array(owners, dtype=np.intp)[positions]
+
+            sums = np.zeros((len(pending), self.matrix.shape[1]), dtype=np.float32)
+            np.add.at(sums, owners, vectors)
+            known = np.zeros(len(pending), dtype=bool)
+            known[owners] = True
+            sums = normalize_rows(sums)
+            for owner, answer in enumerate(pending):
+                self.phrase_vectors[answer] = sums[owner] if known[owner] else None
+
+        queries = np.zeros((len(answers), self.matrix.shape[1]), dtype=np.float32)
+        for row, answer in enumerate(answers):
+            vector = self.phrase_vectors[answer]
+            if vector is not None:
+                queries[row] = vector
+        return queries
+
+    def contained_word_ids(self, answer):
+        ''' Returns the indices of the document words contained
+        in the answer, whatever their case, looked up from the
+        substrings of the answer instead of testing every word
+        of the document
+        '''
+        ids = []
+        answer = answer.lower()
+        length = len(answer)
+        for start in range(length):
+            for stop in range(start + 1, min(length, start + self.max_word_length) + 1):
+                ids.extend(self.word_ids.get(answer[start:stop], ()))
+        return ids
+
+    def nbytes(self):
+        ''' Returns the memory used by the arrays of the document '''
+        phrases = sum(v.nbytes for v in self.phrase_vectors.values() if v is not None)
+        return (self.rows.nbytes + self.matrix.nbytes + self.candidate_mask.nbytes
+                + self.unique_mask.nbytes + phrases)
+
 
 class IncorrectAnswerGenerator:
     ''' This class contains the methods
@@ -17,12 +149,101 @@ class IncorrectAnswerGenerator:
     '''
 
     def __init__(self, document):
-        # model required to fetch similar words
-        self.model = api.load("glove-wiki-gigaword-100")
-        self.all_words = []
-        for sent in sent_tokenize(document):
-            self.all_words.extend(word_tokenize(sent))
-        self.all_words = list(set(self.all_words))
+        # model required to fetch similar words, shared by every request
+        self.model = registry.get('glove')
+        if isinstance(document, PreprocessedDocument):
+            # already tokenized by QuestionGeneration
+            self.all_words = document.vocab
+            self.stop_words = getattr(document, 'stop_words', set())
+        else:
+            self.all_words = []
+            for sent in sent_tokenize(document):
+                self.all_words.extend(word_tokenize(sent))
+            self.all_words = list(set(self.all_words))
+            self.stop_words = set()
+        self.embeddings = None
+        self.similar_words_cache = dict()
+        self.closest_words_cache = dict()  # (answer, topn) -> document words
+
+    def prefetch_similar_words(self, answers, topn=15):
+        ''' Queries the neighbours of all the answers of
+        a quiz in one batched call (ANN index when enabled),
+        for get_all_options_dict to reuse
+        '''
+        if not hasattr(self.model, 'similar_by_words'):
+            return
+        answers = [a for a in dict.fromkeys(answers) if a not in self.similar_words_cache]
+        for answer, similar in zip(answers, self.model.similar_by_words(answers, topn)):
+            if similar is not None:
+                self.similar_words_cache[answer] = similar
+
+    def prefetch_options(self, answers, num_options, topn=15):
+        ''' Resolves the distractors of all the answers of a
+        quiz at once: one batched model query for the known
+        answers, one batched product with the document vocabulary
+        for the others (multi-word or unknown answers)
+        '''
+        self.prefetch_similar_words(answers, topn)
+        pending = [a for a in dict.fromkeys(answers)
+                   if a not in self.similar_words_cache and a not in self.model
+                   and (a, num_options) not in self.closest_words_cache]
+        for answer, words in zip(pending, self.get_closest_document_words_batch(pending, num_options)):
+            self.closest_words_cache[(answer, num_options)] = words
+
+    def build_vocab_matrix(self):
+        ''' Builds once per document the vectors of its
+        words (DocumentEmbeddings) and records their size
+        '''
+        self.embeddings = DocumentEmbeddings(self.model, self.all_words, self.stop_words)
+        annotate('document_vectors_bytes', self.embeddings.nbytes())
+
+    def get_closest_document_words(self, answer, topn):
+        ''' Returns the 'topn' words of the document
+        closest to the answer, most similar first.
+        Unknown words score 0, words contained
+        in the answer score -1, and a word is
+        returned once whatever its case.
+        '''
+        return self.get_closest_document_words_batch([answer], topn)[0]
+
+    def get_closest_document_words_batch(self, answers, topn):
+        ''' Batched get_closest_document_words: the answer
+        vectors are multiplied with the document vocabulary
+        matrix and the 'topn' best words of each row are kept.
+        The rows are computed by blocks on the thread pool.
+        '''
+        if self.embeddings is None:
+            self.build_vocab_matrix()
+        embeddings = self.embeddings
+
+        # one word per lowercase key
+        topn = min(topn, len(embeddings.word_ids))
+        if topn == 0 or not answers:
+            return [[] for _ in answers]
+
+        queries = embeddings.get_phrase_vectors(answers)
+
+        def closest_words(start, stop):
+            scores = np.zeros((stop - start, len(self.all_words)), dtype=np.float32)
+            if len(embeddings.rows):
+                scores[:, embeddings.rows] = queries[start:stop] @ embeddings.matrix.T
+            for row, answer in enumerate(answers[start:stop]):
+                scores[row, embeddings.contained_word_ids(answer)] = -1.0
+            scores[:, ~embeddings.candidate_mask] = -2.0
+            scores[:, ~embeddings.unique_mask] = -3.0
+
+            best = np.argpartition(-scores, topn - 1, axis=1)[:, :topn]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            best = np.take_along_axis(best, np.argsort(-best_scores, axis=1), axis=1)
+            return [[self.all_words[idx] for idx in row] for row in best]
+
+        blocks = [(start, min(start + DISTRACTOR_BLOCK, len(answers)))
+                  for start in range(0, len(answers), DISTRACTOR_BLOCK)]
+        if len(blocks) == 1:
+            return closest_words(*blocks[0])
+        futures = [distractor_thread_pool().submit(closest_words, start, stop)
+                   for start, stop in blocks]
+        return [words for future in futures for words in future.result()]
 
     def get_all_options_dict(self, answer, num_options):
         ''' This method returns a dict
@@ -30,29 +251,28 @@ class IncorrectAnswerGenerator:
         which one is correct and is the answer
         '''
         options_dict = dict()
-        try:
-            similar_words = self.model.similar_by_word(answer, topn=15)[::-1]
+        similar_words = self.similar_words_cache.get(answer)
+        if similar_words is None and answer in self.model:
+            # through similar_by_words, so that the ANN index is used when enabled
+            self.prefetch_similar_words([answer])
+            similar_words = self.similar_words_cache.get(answer)
+            if similar_words is None:
+                similar_words = self.model.similar_by_word(answer, topn=15)
+
+        if similar_words is not None and len(similar_words) >= num_options:
+            similar_words = similar_words[::-1]
 
             for i in range(1, num_options + 1):
                 options_dict[i] = similar_words[i - 1][0]
 
-        except BaseException:
-            self.all_sim = []
-            for word in self.all_words:
-                if word not in answer:
-                    try:
-                        self.all_sim.append(
-                            (self.model.similarity(answer, word), word))
-                    except BaseException:
-                        self.all_sim.append(
-                            (0.0, word))
-                else:
-                    self.all_sim.append((-1.0, word))
-
-            self.all_sim.sort(reverse=True)
-
-            for i in range(1, num_options + 1):
-                options_dict[i] = self.all_sim[i - 1][1]
+        else:
+            # the answer is not a single known word (e.g. "Barack Obama") :
+            # rank the words of the document by cosine to the answer instead
+            closest = self.closest_words_cache.get((answer, num_options))
+            if closest is None:
+                closest = self.get_closest_document_words(answer, num_options)
+            for i, word in enumerate(closest):
+                options_dict[i + 1] = word
 
         replacement_idx = random.randint(1, num_options)
 
@@ -0,0 +1,316 @@
+''' This module contains the timing and profiling
+instrumentation of the question generation pipeline.
+
+Each generer_questions call runs inside a PipelineTrace;
+the pipeline code marks its stages with `with stage('ner'):`.
+Every stage records its wall time, CPU time (of the running
+thread) and, in a profiled call running alone, its peak traced
+memory; each trace also records the peak RSS of the process. The
+traces feed process-wide metrics, served in Prometheus text
+format on /metrics, and
+can also be written as JSON files. An optional cProfile +
+tracemalloc profile can be taken for a single call.
+'''
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+TRACE_DIR = os.environ.get('QUIZ_TRACE_DIR')
+PROFILE_DIR = os.environ.get('QUIZ_PROFILE_DIR', os.path.join('.', 'profiles'))
+# profile every call, or only the ones asked for with the X-Quiz-Profile header
+PROFILE_ALL = os.environ.get('QUIZ_PROFILE', '0') == '1'
+PROFILE_HEADER = os.environ.get('QUIZ_PROFILE_HEADER', '0') == '1'
+
+HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+# tracemalloc is process-wide: it runs while at least one profiled call needs it
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False  # started here (not by the caller of the pipeline)
+# bumped when a profiled call starts while another one runs: the traced peak,
+# process-wide, can no longer be attributed to the stages of either of them
+_tracemalloc_overlaps = 0
+
+
+def _peak_memory_bytes():
+    ''' Peak traced memory when tracemalloc runs, otherwise None
+    (the process RSS is not a measure of a single stage)
+    '''
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    return None
+
+
+def _process_peak_rss_bytes():
+    ''' Peak RSS of the whole process since it started '''
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _acquire_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started, _tracemalloc_overlaps
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_started = True
+        if _tracemalloc_users > 0:
+            _tracemalloc_overlaps += 1
+        _tracemalloc_users += 1
+
+
+def _start_peak():
+    ''' Resets the traced peak for a stage of the only profiled
+    call of the process. Returns a token for _stage_peak, or None
+    when the peak is shared with another profiled call
+    '''
+    with _tracemalloc_lock:
+        if _tracemalloc_users != 1 or not tracemalloc.is_tracing():
+            return None
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        return _tracemalloc_overlaps
+
+
+def _stage_peak(token):
+    ''' Peak traced memory since _start_peak, or None if another
+    profiled call ran meanwhile (its allocations are counted too)
+    '''
+    with _tracemalloc_lock:
+        if token is None or token != _tracemalloc_overlaps or _tracemalloc_users != 1:
+            return None
+        return _peak_memory_bytes()
+
+
+def _release_tracemalloc(snapshot=False):
+    ''' Stops tracemalloc after its last user. Returns a
+    snapshot taken before (None if it was not tracing)
+    '''
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        taken = tracemalloc.take_snapshot() if snapshot and tracemalloc.is_tracing() else None
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+    return taken
+
+
+class PipelineTrace:
+    ''' This class records the stages of one pipeline run '''
+
+    def __init__(self, name, profiled=False):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        # only profiled calls run tracemalloc and measure the memory of their stages
+        self.profiled = profiled
+        self.started_at = time.time()
+        self.stages = []
+        self.annotations = dict()
+        self._accumulated = dict()  # stage name -> its record
+
+    @contextmanager
+    def stage(self, name, accumulate=False):
+        ''' Records a stage. With 'accumulate', the runs of a stage
+        entered several times (once per streamed question) are
+        summed into a single record
+        '''
+        peak_token = _start_peak() if self.profiled else None
+        first_inner = len(self.stages)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            # the inner stages reset the tracemalloc peak : keep the highest
+            peaks = [_stage_peak(peak_token)] + [inner['peak_memory_bytes']
+                                              for inner in self.stages[first_inner:]]
+            peaks = [peak for peak in peaks if peak is not None]
+            peak = max(peaks) if peaks else None
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.thread_time() - cpu_start
+            record = self._accumulated.get(name) if accumulate else None
+            if record is not None:
+                record['wall_seconds'] += wall_seconds
+                record['cpu_seconds'] += cpu_seconds
+                if peak is not None:
+                    record['peak_memory_bytes'] = max(record['peak_memory_bytes'] or 0, peak)
+            else:
+                record = {
+                    'stage': name,
+                    'wall_seconds': wall_seconds,
+                    'cpu_seconds': cpu_seconds,
+                    'peak_memory_bytes': peak,
+                }
+                self.stages.append(record)
+                if accumulate:
+                    self._accumulated[name] = record
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'stages': self.stages,
+            'annotations': self.annotations,
+        }
+
+
+@contextmanager
+def stage(name, accumulate=False):
+    ''' Marks a stage of the current pipeline run
+    (does nothing outside of a trace). With 'accumulate',
+    every run of the stage adds to one record of the trace.
+    '''
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name, accumulate):
+        yield
+
+
+def annotate(name, value):
+    ''' Attaches a value (a size, a count...) to the current
+    pipeline run (does nothing outside of a trace)
+    '''
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotations[name] = value
+
+
+class Metrics:
+    ''' This class aggregates the stages of all the traces
+    of the process
+    '''
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self._stages = dict()  # stage -> aggregated values
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        with self._lock:
+            for record in trace.stages:
+                stats = self._stages.setdefault(record['stage'], {
+                    'count': 0,
+                    'wall_seconds': 0.0,
+                    'cpu_seconds': 0.0,
+                    'peak_memory_bytes': None,
+                    'buckets': [0] * len(self.buckets),
+                })
+                stats['count'] += 1
+                stats['wall_seconds'] += record['wall_seconds']
+                stats['cpu_seconds'] += record['cpu_seconds']
+                if record['peak_memory_bytes'] is not None:
+                    stats['peak_memory_bytes'] = max(
+                        stats['peak_memory_bytes'] or 0, record['peak_memory_bytes'])
+                for i, bound in enumerate(self.buckets):
+                    if record['wall_seconds'] <= bound:
+                        stats['buckets'][i] += 1
+
+    def render_prometheus(self):
+        ''' Returns the metrics in Prometheus text format '''
+        with self._lock:
+            stages = {name: dict(stats) for name, stats in self._stages.items()}
+
+        lines = [
+            '# HELP quizzet_stage_seconds Wall time of the pipeline stages.',
+            '# TYPE quizzet_stage_seconds histogram',
+        ]
+        for name, stats in stages.items():
+            for bound, count in zip(self.buckets, stats['buckets']):
+                lines.append(f'quizzet_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'quizzet_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'quizzet_stage_seconds_sum{{stage="{name}"}} {stats["wall_seconds"]:.6f}')
+            lines.append(f'quizzet_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+
+        lines.append('# HELP quizzet_stage_cpu_seconds_total CPU time of the pipeline stages.')
+        lines.append('# TYPE quizzet_stage_cpu_seconds_total counter')
+        for name, stats in stages.items():
+            lines.append(f'quizzet_stage_cpu_seconds_total{{stage="{name}"}} {stats["cpu_seconds"]:.6f}')
+
+        lines.append('# HELP quizzet_stage_peak_memory_bytes Highest peak traced memory '
+                     '(tracemalloc, profiled calls running alone) seen in a stage.')
+        lines.append('# TYPE quizzet_stage_peak_memory_bytes gauge')
+        for name, stats in stages.items():
+            if stats['peak_memory_bytes'] is not None:
+                lines.append(f'quizzet_stage_peak_memory_bytes{{stage="{name}"}} {stats["peak_memory_bytes"]}')
+
+        lines.append('# HELP quizzet_process_peak_rss_bytes Peak RSS of the process since it started.')
+        lines.append('# TYPE quizzet_process_peak_rss_bytes gauge')
+        lines.append(f'quizzet_process_peak_rss_bytes {_process_peak_rss_bytes()}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _write_profile(trace, profiler, snapshot):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{trace.name}-{trace.id}")
+    profiler.dump_stats(base + '.prof')
+    with open(base + '.txt', 'w') as report:
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(40)
+        if snapshot is not None:
+            report.write('\nTop memory allocations:\n')
+            for stat in snapshot.statistics('lineno')[:25]:
+                report.write(f"{stat}\n")
+    print(f"[PROFILE] {base}.prof / {base}.txt")
+
+
+@contextmanager
+def trace_pipeline(name, profile=False):
+    ''' Runs a pipeline call inside a new trace. The trace is
+    added to the metrics and written to QUIZ_TRACE_DIR if set.
+    With 'profile' (or QUIZ_PROFILE=1), the call is also run
+    under cProfile and tracemalloc.
+    '''
+    profiled = profile or PROFILE_ALL
+    trace = PipelineTrace(name, profiled)
+    token = _current_trace.set(trace)
+
+    profiler = None
+    if profiled:
+        _acquire_tracemalloc()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # another profiler is already running in this process
+            print(f"[PROFILE ERROR] {e}")
+            profiler = None
+
+    try:
+        with trace.stage('total'):
+            yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.annotations['process_peak_rss_bytes'] = _process_peak_rss_bytes()
+        if profiler is not None:
+            profiler.disable()
+        if profiled:
+            snapshot = _release_tracemalloc(snapshot=profiler is not None)
+        if profiler is not None:
+            try:
+                _write_profile(trace, profiler, snapshot)
+            except OSError as e:
+                print(f"[PROFILE ERROR] {e}")
+
+        metrics.record(trace)
+        if TRACE_DIR:
+            try:
+                os.makedirs(TRACE_DIR, exist_ok=True)
+                with open(os.path.join(TRACE_DIR, f"{trace.id}.json"), 'w') as trace_file:
+                    json.dump(trace.to_dict(), trace_file, indent=2)
+            except OSError as e:
+                print(f"[TRACE ERROR] {e}")
@@ -0,0 +1,211 @@
+''' This module contains the in-process job queue
+used to generate the quizzes outside of the request thread.
+
+A bounded pool of background threads runs the jobs; they
+share the models of the process-wide registry. When the
+queue is full, submit() raises QueueFull so the caller can
+answer with HTTP 429.
+
+A job whose function returns a generator of (key, value) pairs
+is a streaming job: its items can be read while it runs, and
+its result is the dict of all of them.
+'''
+import inspect
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+JOB_WORKERS = int(os.environ.get('QUIZ_JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('QUIZ_JOB_QUEUE', 16))
+# finished jobs kept around for their status/result to be fetched
+JOB_HISTORY = int(os.environ.get('QUIZ_JOB_HISTORY', 256))
+
+
+class QueueFull(Exception):
+    ''' Raised when the job queue has reached its depth limit '''
+
+
+class Job:
+    ''' This class holds the state, result and timings of a job '''
+
+    def __init__(self, func, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # items produced so far by a streaming job
+        self.items = []
+        self._updated = threading.Condition()
+        self._callbacks = []
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def timings(self):
+        ''' Returns the time spent waiting and running, in seconds '''
+        now = time.time()
+        started = self.started_at or now
+        return {
+            'queued_seconds': round(started - self.submitted_at, 3),
+            'run_seconds': round((self.finished_at or now) - started, 3)
+            if self.started_at else 0.0,
+        }
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'items': len(self.items),
+            **self.timings(),
+        }
+
+    def _consume(self, items):
+        ''' Publishes the items of a streaming job as
+        they are produced and returns the dict of them
+        '''
+        for item in items:
+            with self._updated:
+                self.items.append(item)
+                self._updated.notify_all()
+        return dict(self.items)
+
+    def add_done_callback(self, callback):
+        ''' Calls callback(job) once the job is finished
+        (right away if it already is)
+        '''
+        with self._updated:
+            if not self.finished:
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def _run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception as e:
+            print(f"[JOB ERROR] {self.id} callback: {e}")
+
+    def _notify(self):
+        with self._updated:
+            self._updated.notify_all()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def iter_items(self, heartbeat=None):
+        ''' Yields the items of the job as they are produced,
+        until it is finished. When 'heartbeat' seconds go by
+        without a new item, None is yielded instead.
+        '''
+        sent = 0
+        while True:
+            with self._updated:
+                if sent == len(self.items) and not self.finished:
+                    self._updated.wait(heartbeat)
+                items = self.items[sent:]
+                finished = self.finished
+            if not items and not finished:
+                yield None
+            yield from items
+            sent += len(items)
+            if finished and sent == len(self.items):
+                return
+
+
+class JobQueue:
+    ''' This class runs the submitted jobs on a
+    bounded pool of daemon threads
+    '''
+
+    def __init__(self, max_workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE,
+                 history=JOB_HISTORY):
+        self.max_workers = max_workers
+        self.history = history
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._running = 0
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._work, daemon=True,
+                                      name=f"quiz-job-{len(self._workers)}")
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, func, *args, **kwargs):
+        ''' Queues func(*args, **kwargs) and returns its Job.
+        Raises QueueFull when too many jobs are waiting.
+        '''
+        job = Job(func, args, kwargs)
+        with self._lock:
+            self._start_workers()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull(
+                    f"{self._queue.maxsize} jobs already waiting") from None
+            self._jobs[job.id] = job
+            self._forget_finished_jobs()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _forget_finished_jobs(self):
+        excess = len(self._jobs) - self.history
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].finished:
+                del self._jobs[job_id]
+                excess -= 1
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self._running += 1
+            job.status = 'running'
+            job.started_at = time.time()
+            try:
+                result = job.func(*job.args, **job.kwargs)
+                if inspect.isgenerator(result):
+                    result = job._consume(result)
+                job.result = result
+                job.status = 'done'
+            except Exception as e:
+                print(f"[JOB ERROR] {job.id}: {e}")
+                job.error = str(e)
+                job.status = 'failed'
+            finally:
+                job.finished_at = time.time()
+                # drop the references to the arguments (uploaded file...)
+                job.args = job.kwargs = None
+                job._notify()
+                with self._lock:
+                    self._running -= 1
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            'workers': self.max_workers,
+            'queued': self._queue.qsize(),
+            'max_queued': self._queue.maxsize,
+            'running': self._running,
+        }
+
+
+job_queue = JobQueue()
@@ -0,0 +1,176 @@
+''' This module contains the process-wide registry
+of the heavy NLP models (spaCy NER tagger, GloVe vectors).
+
+Each model is loaded at most once per process and the same
+reference is handed to every request, so building a new
+QuestionGeneration per upload no longer reloads anything.
+'''
+import os
+import resource
+import threading
+import time
+from functools import lru_cache
+
+SPACY_MODELS = ('en_core_web_md', 'en_core_web_sm')
+GLOVE_MODEL = 'glove-wiki-gigaword-100'
+
+
+def _current_rss_kb():
+    ''' Returns the resident set size of the process in KB '''
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        # no procfs (macOS...) : fall back to the peak RSS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def load_spacy_model():
+    ''' Loads the spaCy NER tagger, falling back
+    to the small model when the medium one is missing
+    '''
+    import spacy
+
+    for name in SPACY_MODELS:
+        try:
+            return spacy.load(name)
+        except OSError:
+            print(f"[MODEL REGISTRY] spaCy model '{name}' not found.")
+    print("[MODEL REGISTRY] No spaCy model found. Install at least "
+          "'en_core_web_sm' with: python -m spacy download en_core_web_sm")
+    raise OSError("No spaCy model available")
+
+
+def load_glove_model():
+    ''' Loads the GloVe word vectors used for the distractors.
+    The vectors are read from the memory-mapped store, which is
+    built from the gensim download the first time.
+    '''
+    import glove_store
+
+    if not glove_store.store_exists():
+        import gensim.downloader as api
+
+        print("[MODEL REGISTRY] Building the GloVe store in "
+              f"{glove_store.DEFAULT_STORE_DIR}...")
+        glove_store.build_store(api.load(GLOVE_MODEL))
+    return glove_store.GloveStore()
+
+
+@lru_cache(maxsize=None)
+def model_versions():
+    ''' Returns the installed version of each model,
+    without loading them (used to key cached quizzes)
+    '''
+    from importlib import metadata
+
+    versions = []
+    for name in SPACY_MODELS:
+        try:
+            versions.append(f"{name}={metadata.version(name)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{name}=absent")
+    versions.append(GLOVE_MODEL)
+    return tuple(versions)
+
+
+class ModelRegistry:
+    ''' This class keeps one instance of each
+    registered model for the whole process
+    '''
+
+    def __init__(self):
+        self._loaders = dict()
+        self._models = dict()
+        self._stats = dict()
+        self._errors = dict()
+        self._locks = dict()
+        self._registry_lock = threading.Lock()
+
+    def register(self, name, loader):
+        ''' Registers (or replaces) the loader of a model.
+        An already loaded instance of that model is dropped.
+        '''
+        with self._registry_lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+            self._models.pop(name, None)
+            self._stats.pop(name, None)
+            self._errors.pop(name, None)
+
+    def get(self, name):
+        ''' Returns the shared instance of a model,
+        loading it on first use
+        '''
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        try:
+            lock = self._locks[name]
+        except KeyError:
+            raise KeyError(f"Unknown model: {name}") from None
+
+        # only one thread loads a given model, the others wait for it
+        with lock:
+            model = self._models.get(name)
+            if model is None:
+                model = self._load(name)
+        return model
+
+    def _load(self, name):
+        print(f"[MODEL REGISTRY] Loading '{name}'...")
+        rss_before = _current_rss_kb()
+        start = time.perf_counter()
+
+        try:
+            model = self._loaders[name]()
+        except Exception as e:
+            self._errors[name] = str(e)
+            raise
+
+        self._stats[name] = {
+            'load_seconds': round(time.perf_counter() - start, 3),
+            'rss_delta_kb': max(0, _current_rss_kb() - rss_before),
+        }
+        self._models[name] = model
+        self._errors.pop(name, None)
+        print(f"[MODEL REGISTRY] '{name}' loaded in "
+              f"{self._stats[name]['load_seconds']}s "
+              f"(+{self._stats[name]['rss_delta_kb'] // 1024} MB)")
+        return model
+
+    def warm_up(self, names=None):
+        ''' Loads the given models (all of them by default)
+        so the first request does not pay for it
+        '''
+        for name in names or list(self._loaders):
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"[MODEL REGISTRY] Unable to load '{name}': {e}")
+
+    def is_ready(self):
+        ''' True once every registered model is loaded '''
+        return all(name in self._models for name in list(self._loaders))
+
+    def status(self):
+        ''' Returns whether each registered model is loaded,
+        with the error of its last failed load if any
+        '''
+        status = dict()
+        for name in list(self._loaders):
+            status[name] = {'loaded': name in self._models}
+            if name in self._errors:
+                status[name]['error'] = self._errors[name]
+        return status
+
+    def stats(self):
+        ''' Returns the load time and memory of each loaded model '''
+        return {name: dict(stat) for name, stat in self._stats.items()}
+
+
+registry = ModelRegistry()
+registry.register('spacy', load_spacy_model)
+registry.register('glove', load_glove_model)
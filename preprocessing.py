@@ -0,0 +1,38 @@
+"""Ce module contient le document prétraité partagé par toutes les étapes
+de la génération de questions, pour que le texte ne soit découpé qu'une fois
+"""
+from nltk.tokenize import sent_tokenize, word_tokenize
+
+
+class PreprocessedDocument:
+    """ Cette classe contient un document nettoyé découpé une seule fois en
+    phrases et en mots, ainsi que les phrases sans mots vides et le vocabulaire
+    """
+
+    def __init__(self, text, stop_words):
+        """
+        Params:
+            * text : document déjà nettoyé (QuestionGeneration.clean_text)
+            * stop_words : set<str> des mots vides
+        """
+        self.text = text
+        self.stop_words = stop_words
+        self.sentences = sent_tokenize(text)
+        self.tokens = [word_tokenize(sentence) for sentence in self.sentences]
+
+        # phrases sans les mots vides, pour le tf-idf
+        self.filtered_sentences = [
+            ' '.join(w for w in words if w.lower() not in stop_words)
+            for words in self.tokens
+        ]
+
+        # mots distincts du document, dans l'ordre d'apparition
+        self.vocab = list(dict.fromkeys(w for words in self.tokens for w in words))
+
+        # mots (en minuscules) de chaque phrase, et index inversé :
+        # mot -> numéros des phrases qui le contiennent
+        self.sentence_token_sets = [{w.lower() for w in words} for words in self.tokens]
+        self.token_index = dict()
+        for sentence_id, token_set in enumerate(self.sentence_token_sets):
+            for token in token_set:
+                self.token_index.setdefault(token, set()).add(sentence_id)
@@ -1,19 +1,39 @@
 """Ce fichier contient le module pour générer des questions
 """
+import heapq
+
 import nltk
-import spacy
+import numpy as np
 from nltk.corpus import stopwords
-from nltk.tokenize import sent_tokenize, word_tokenize
+from nltk.tokenize import word_tokenize
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+from instrumentation import stage
+from model_registry import registry
+from preprocessing import PreprocessedDocument
+
+# Taille maximale (en caractères) des morceaux de texte passés à spacy,
+# bien en dessous de nlp.max_length pour que la mémoire reste bornée
+NER_CHUNK_CHARS = 100000
+NER_BATCH_SIZE = 4
+# composants inutiles à la reconnaissance d'entités
+NER_DISABLED_PIPES = ('tagger', 'parser', 'lemmatizer', 'attribute_ruler')
+
 
 class QuestionExtractor:
     """ Cette classe contient toutes les méthodes
     requises pour extraire des questions d'un document donné
     """
 
-    def __init__(self, num_questions):
+    def __init__(self, num_questions, corpus=None):
+        """
+        Params:
+            * num_questions : nombre de questions
+            * corpus : corpus.CorpusStatistics, dont l'IDF pondère les mots
+              (sinon l'IDF est calculé sur les phrases du document)
+        """
         self.num_questions = num_questions
+        self.corpus = corpus
 
         # hash set pour une recherche rapide
         try:
@@ -24,24 +44,17 @@ class QuestionExtractor:
             nltk.download('punkt')
             self.stop_words = set(stopwords.words('english'))
 
-        # tagueur de reconnaissance d'entités nommées
-        try:
-            self.ner_tagger = spacy.load('en_core_web_md')
-        except OSError:
-            print("Modèle spaCy 'en_core_web_md' non trouvé.")
-            print("Installez-le avec: python -m spacy download en_core_web_md")
-            try:
-                # Essayer le modèle plus petit en fallback
-                self.ner_tagger = spacy.load('en_core_web_sm')
-                print("Utilisation du modèle 'en_core_web_sm' à la place.")
-            except OSError:
-                print("Aucun modèle spaCy trouvé. Installez au moins 'en_core_web_sm'")
-                raise
-
         self.vectorizer = TfidfVectorizer()
         self.questions_dict = dict()
 
-    def get_questions_dict(self, document):
+    @property
+    def ner_tagger(self):
+        """Tagueur de reconnaissance d'entités nommées, partagé par tout le processus.
+        Chargé à la première utilisation : les processus qui reçoivent des
+        entités déjà extraites (mode batch) ne chargent pas spacy"""
+        return registry.get('spacy')
+
+    def get_questions_dict(self, document, entities=None):
         """
         Retourne un dict de questions au format:
         question_number: {
@@ -50,52 +63,98 @@ class QuestionExtractor:
         }
 
         Params:
-            * document : string
+            * document : string ou PreprocessedDocument
+            * entities : list<str>, entités déjà extraites (mode batch)
         Returns:
             * dict
         """
+        self.questions_dict = dict()
         try:
-            # trouver les mots-clés candidats
-            self.candidate_keywords = self.get_candidate_entities(document)
-
-            if not self.candidate_keywords:
-                print("Aucune entité trouvée dans le document")
+            if not self.prepare_candidates(document, entities):
                 return {}
 
-            # définir les scores des mots avant de classer les mots-clés candidats
-            self.set_tfidf_scores(document)
-
-            # classer les mots-clés en utilisant les scores tf idf calculés
-            self.rank_keywords()
+            with stage('ranking'):
+                # classer les mots-clés en utilisant les scores tf idf calculés
+                self.rank_keywords()
 
-            # former les questions
-            self.form_questions()
+                # former les questions
+                self.form_questions()
 
             return self.questions_dict
         except Exception as e:
             print(f"Erreur dans get_questions_dict: {e}")
             return {}
 
-    def get_filtered_sentences(self, document):
-        """ Retourne une liste de phrases - chacune
-        ayant été nettoyée des mots vides.
+    def iter_questions(self, document, entities=None):
+        """ Génère les questions une à une, au format
+        (question_number, {question: str, answer: str}),
+        et s'arrête après 'num_questions' questions
+
         Params:
-                * document: un paragraphe de phrases
+            * document : string ou PreprocessedDocument
+            * entities : list<str>, entités déjà extraites (mode batch)
+        Yields:
+            * (int, dict)
+        """
+        self.questions_dict = dict()
+        try:
+            if not self.prepare_candidates(document, entities):
+                return
+
+            # le classement, la recherche des phrases et la formation des
+            # questions sont comptés dans une seule étape 'ranking'
+            with stage('ranking', accumulate=True):
+                self.rank_keywords()
+
+            formed_questions = self.iter_formed_questions()
+            try:
+                while True:
+                    with stage('ranking', accumulate=True):
+                        formed = next(formed_questions, None)
+                    if formed is None:
+                        return
+                    number, question = formed
+                    self.questions_dict[number] = question
+                    yield number, question
+            finally:
+                formed_questions.close()
+        except Exception as e:
+            print(f"Erreur dans iter_questions: {e}")
+
+    def prepare_candidates(self, document, entities=None):
+        """ Trouve les mots-clés candidats et calcule les scores tf-idf
+        nécessaires à leur classement
         Returns:
-                * list<str> : liste de chaînes
+            * bool : False si aucune entité n'a été trouvée
         """
-        sentences = sent_tokenize(document)  # diviser les documents en phrases
-        return [self.filter_sentence(sentence) for sentence in sentences]
+        document = self.preprocess(document)
+
+        # trouver les mots-clés candidats
+        if entities is None:
+            with stage('ner'):
+                entities = self.get_candidate_entities(document)
+        self.candidate_keywords = entities
+
+        if not self.candidate_keywords:
+            print("Aucune entité trouvée dans le document")
+            return False
 
-    def filter_sentence(self, sentence):
-        """Retourne la phrase sans les mots vides
+        # définir les scores des mots avant de classer les mots-clés candidats
+        with stage('tfidf'):
+            self.set_tfidf_scores(document)
+        return True
+
+    def preprocess(self, document):
+        """ Retourne le document découpé en phrases et en mots
+        (inchangé s'il l'est déjà)
         Params:
-                * sentence: Une chaîne
+                * document: string ou PreprocessedDocument
         Returns:
-                * string
+                * PreprocessedDocument
         """
-        words = word_tokenize(sentence)
-        return ' '.join(w for w in words if w.lower() not in self.stop_words)
+        if isinstance(document, PreprocessedDocument):
+            return document
+        return PreprocessedDocument(document, self.stop_words)
 
     def get_candidate_entities(self, document):
         """ Retourne une liste d'entités selon
@@ -103,168 +162,310 @@ class QuestionExtractor:
         pour les questions
 
         Params:
-                * document : string
+                * document : string ou PreprocessedDocument
         Returns:
                 * list<str>
         """
         try:
-            entities = self.ner_tagger(document)
-            entity_list = []
-
-            for ent in entities.ents:
-                text = ent.text.strip()
-
-                # Filtrage amélioré des entités
-                if (len(text) > 2 and                           # Plus de 2 caractères
-                    ent.label_ in [
-                        'PERSON',      # Personnes
-                        'ORG',         # Organisations
-                        'GPE',         # Pays, villes, états
-                        'DATE',        # Dates
-                        'MONEY',       # Montants
-                        'PERCENT',     # Pourcentages
-                        'EVENT',       # Événements (batailles, révolutions, etc.)
-                        'PRODUCT',     # Produits, inventions
-                        'WORK_OF_ART', # Œuvres d'art, livres, films
-                        'LAW',         # Lois, traités
-                        'NORP',        # Nationalités, groupes religieux/politiques
-                        'FACILITY',    # Bâtiments, aéroports, ponts
-                        'LANGUAGE'     # Langues
-                    ] and
-                    not text.isdigit() and                      # Éviter les nombres seuls
-                    len(text.split()) <= 4 and                  # Max 4 mots
-                    not text.lower() in ['le', 'la', 'les', 'de', 'du', 'des', 'un', 'une'] # Éviter articles français
-                ):
-                    entity_list.append(text)
-
-            return list(set(entity_list))  # supprimer les doublons
+            sentences = self.preprocess(document).sentences
+            for _, entities in self.iter_entities_batch([(None, sentences)]):
+                return entities
+            return []
         except Exception as e:
             print(f"Erreur lors de l'extraction des entités: {e}")
             return []
 
-    def set_tfidf_scores(self, document):
-        """ Définit les scores tf-idf pour chaque mot"""
-        try:
-            self.unfiltered_sentences = sent_tokenize(document)
-            self.filtered_sentences = self.get_filtered_sentences(document)
+    def iter_chunks(self, sentences, max_chars=NER_CHUNK_CHARS):
+        """ Regroupe les phrases d'un document en morceaux d'au plus
+        'max_chars' caractères (une phrase plus longue est coupée sur un espace)
+        """
+        chunk = []
+        size = 0
+        for sentence in sentences:
+            if chunk and size + len(sentence) + 1 > max_chars:
+                yield ' '.join(chunk)
+                chunk = []
+                size = 0
 
-            if not self.filtered_sentences:
-                print("Aucune phrase filtrée trouvée")
-                return
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(' ', 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                yield sentence[:cut]
+                sentence = sentence[cut:].lstrip()
 
-            self.word_score = dict()  # (word, score)
+            chunk.append(sentence)
+            size += len(sentence) + 1
 
-            # (word, sentence where word score is max)
-            self.sentence_for_max_word_score = dict()
+        if chunk:
+            yield ' '.join(chunk)
 
-            tf_idf_vector = self.vectorizer.fit_transform(self.filtered_sentences)
+    def iter_entities_batch(self, documents, batch_size=NER_BATCH_SIZE, n_process=1):
+        """ Extrait les entités candidates de plusieurs documents.
 
-            # Gestion des différentes versions de sklearn
-            try:
-                feature_names = self.vectorizer.get_feature_names_out()
-            except AttributeError:
-                feature_names = self.vectorizer.get_feature_names()
+        Chaque document est découpé en morceaux qui passent dans nlp.pipe
+        (sans les composants inutiles) ; les entités sont fusionnées au fil
+        de l'eau, sans garder les Doc spacy en mémoire.
 
-            tf_idf_matrix = tf_idf_vector.todense().tolist()
+        Params:
+                * documents : itérable de paires (clé, liste des phrases)
+        Yields:
+                * (clé, list<str>)
+        """
+        def chunks():
+            for key, sentences in documents:
+                # un morceau d'avance pour savoir lequel est le dernier
+                previous = None
+                for piece in self.iter_chunks(sentences):
+                    if previous is not None:
+                        yield previous, (key, False)
+                    previous = piece
+                yield previous or '', (key, True)
+
+        disabled = [name for name in NER_DISABLED_PIPES
+                    if name in self.ner_tagger.pipe_names]
+        entities = set()
+        for parsed, (key, last_chunk) in self.ner_tagger.pipe(
+                chunks(), as_tuples=True, batch_size=batch_size,
+                n_process=n_process, disable=disabled):
+            entities.update(self.filter_entities(parsed))
+            if last_chunk:
+                yield key, list(entities)
+                entities = set()
+
+    def filter_entities(self, parsed_document):
+        """ Retourne les entités d'un document déjà
+        analysé par spacy qui peuvent servir de réponse
 
-            num_sentences = len(self.unfiltered_sentences)
-            num_features = len(feature_names)
+        Params:
+                * parsed_document : spacy Doc
+        Returns:
+                * list<str>
+        """
+        entity_list = []
+
+        for ent in parsed_document.ents:
+            text = ent.text.strip()
+
+            # Filtrage amélioré des entités
+            if (len(text) > 2 and                           # Plus de 2 caractères
+                ent.label_ in [
+                    'PERSON',      # Personnes
+                    'ORG',         # Organisations
+                    'GPE',         # Pays, villes, états
+                    'DATE',        # Dates
+                    'MONEY',       # Montants
+                    'PERCENT',     # Pourcentages
+                    'EVENT',       # Événements (batailles, révolutions, etc.)
+                    'PRODUCT',     # Produits, inventions
+                    'WORK_OF_ART', # Œuvres d'art, livres, films
+                    'LAW',         # Lois, traités
+                    'NORP',        # Nationalités, groupes religieux/politiques
+                    'FACILITY',    # Bâtiments, aéroports, ponts
+                    'LANGUAGE'     # Langues
+                ] and
+                not text.isdigit() and                      # Éviter les nombres seuls
+                len(text.split()) <= 4 and                  # Max 4 mots
+                not text.lower() in ['le', 'la', 'les', 'de', 'du', 'des', 'un', 'une'] # Éviter articles français
+            ):
+                entity_list.append(text)
+
+        return list(set(entity_list))  # supprimer les doublons
 
-            for i in range(num_features):
-                word = feature_names[i]
-                self.sentence_for_max_word_score[word] = ""
-                tot = 0.0
-                cur_max = 0.0
+    def set_tfidf_scores(self, document):
+        """ Définit les scores tf-idf pour chaque mot"""
+        try:
+            self.document = document = self.preprocess(document)
+            self.unfiltered_sentences = document.sentences
+            self.filtered_sentences = document.filtered_sentences
+
+            if not self.filtered_sentences:
+                print("Aucune phrase filtrée trouvée")
+                return
 
-                for j in range(num_sentences):
-                    if j < len(tf_idf_matrix):
-                        tot += tf_idf_matrix[j][i]
+            if self.corpus is not None:
+                # mode corpus : l'IDF vient du corpus, rien n'est réajusté
+                tf_idf_vector, feature_names = self.corpus.transform(self.filtered_sentences)
+            else:
+                tf_idf_vector = self.vectorizer.fit_transform(self.filtered_sentences)
 
-                        if tf_idf_matrix[j][i] > cur_max:
-                            cur_max = tf_idf_matrix[j][i]
-                            self.sentence_for_max_word_score[word] = self.unfiltered_sentences[j]
+                # Gestion des différentes versions de sklearn
+                try:
+                    feature_names = self.vectorizer.get_feature_names_out()
+                except AttributeError:
+                    feature_names = self.vectorizer.get_feature_names()
 
-                # score moyen pour chaque mot
-                self.word_score[word] = tot / num_sentences if num_sentences > 0 else 0
+            self.score_tfidf_matrix(tf_idf_vector, feature_names, self.unfiltered_sentences)
         except Exception as e:
             print(f"Erreur lors du calcul des scores TF-IDF: {e}")
 
-    def get_keyword_score(self, keyword):
+    def score_tfidf_matrix(self, tf_idf_vector, feature_names, sentences):
+        """ Définit, directement sur la matrice creuse (phrases x mots),
+        le score moyen de chaque mot et l'indice de la phrase où son score est maximal.
+        La mémoire utilisée est proportionnelle au nombre de valeurs non nulles.
+        Params:
+            * tf_idf_vector : matrice creuse scipy
+            * feature_names : mot de chaque colonne
+            * sentences : phrase de chaque ligne
+        """
+        num_sentences = len(sentences)
+        csc = tf_idf_vector.tocsc()
+        csc.sort_indices()  # la première occurrence du max est la première phrase
+
+        num_features = csc.shape[1]
+        counts = np.diff(csc.indptr)
+        columns = np.repeat(np.arange(num_features), counts)
+
+        # score moyen pour chaque mot
+        totals = np.bincount(columns, weights=csc.data, minlength=num_features)
+        means = totals / num_sentences if num_sentences > 0 else np.zeros(num_features)
+
+        # score max de chaque mot et première ligne où il est atteint
+        col_max = np.zeros(num_features)
+        non_empty = counts > 0
+        col_max[non_empty] = np.maximum.reduceat(csc.data, csc.indptr[:-1][non_empty])
+        at_max = np.flatnonzero(csc.data == col_max[columns])
+        max_cols, first = np.unique(columns[at_max], return_index=True)
+        argmax_row = np.full(num_features, -1)
+        argmax_row[max_cols] = csc.indices[at_max[first]]
+
+        self.word_score = dict(zip(feature_names, means.tolist()))  # (word, score)
+
+        # (word, index of the sentence where word score is max)
+        self.sentence_id_for_max_word_score = {
+            word: row
+            for word, row, score in zip(feature_names, argmax_row.tolist(), col_max.tolist())
+            if score > 0 and 0 <= row < num_sentences
+        }
+
+    def get_keyword_score(self, keyword, words=None):
         """ Retourne le score pour un mot-clé
         Params:
             * keyword : string de possibles plusieurs mots
+            * words : mots du mot-clé, s'ils sont déjà découpés
         Returns:
             * float : score
         """
         score = 0.0
-        words = word_tokenize(keyword.lower())
+        if words is None:
+            words = word_tokenize(keyword.lower())
         for word in words:
             if word in self.word_score:
                 score += self.word_score[word]
         return score
 
-    def get_corresponding_sentence_for_keyword(self, keyword):
+    def get_corresponding_sentence_for_keyword(self, keyword, words=None):
         """ Trouve et retourne une phrase contenant
-        les mots-clés
+        tous les mots du mot-clé (mots entiers, grâce à l'index inversé
+        du document) : de préférence celle où l'un des mots a son
+        score maximal, sinon la première du document
         """
-        words = word_tokenize(keyword.lower())
-        for word in words:
-            if word not in self.sentence_for_max_word_score:
-                continue
+        if words is None:
+            words = word_tokenize(keyword.lower())
+        if not words:
+            return ""
 
-            sentence = self.sentence_for_max_word_score[word]
-
-            all_present = True
-            for w in words:
-                if w.lower() not in sentence.lower():
-                    all_present = False
-                    break
-
-            if all_present:
-                return sentence
+        token_sets = self.document.sentence_token_sets
+        for word in words:
+            sentence_id = self.sentence_id_for_max_word_score.get(word)
+            if sentence_id is not None and all(w in token_sets[sentence_id] for w in words):
+                return self.unfiltered_sentences[sentence_id]
+
+        postings = [self.document.token_index.get(w) for w in words]
+        if not all(postings):
+            return ""
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        if candidates:
+            return self.unfiltered_sentences[min(candidates)]
         return ""
 
     def rank_keywords(self):
-        """Classer les mots-clés selon leur score"""
-        self.candidate_triples = []  # (score, keyword, corresponding sentence)
+        """Classer les mots-clés selon leur score.
 
-        for candidate_keyword in self.candidate_keywords:
-            sentence = self.get_corresponding_sentence_for_keyword(candidate_keyword)
-            if sentence:  # Seulement ajouter si une phrase correspondante est trouvée
-                self.candidate_triples.append([
-                    self.get_keyword_score(candidate_keyword),
-                    candidate_keyword,
-                    sentence
-                ])
-
-        self.candidate_triples.sort(reverse=True)
+        Seuls les scores sont calculés ici, pour tous les candidats, et rangés
+        dans un tas ; la phrase de chaque mot-clé n'est cherchée que lorsqu'il
+        sort du tas (iter_ranked_candidates), donc pour les premiers seulement.
+        """
+        self.candidate_triples = []  # (score, keyword, corresponding sentence)
+        self.candidate_words = [word_tokenize(keyword.lower())
+                                for keyword in self.candidate_keywords]
+
+        # tas min de (-score, index du candidat)
+        self.candidate_heap = [
+            (-self.get_keyword_score(keyword, words), idx)
+            for idx, (keyword, words) in enumerate(zip(self.candidate_keywords,
+                                                       self.candidate_words))
+        ]
+        heapq.heapify(self.candidate_heap)
+
+    def iter_ranked_candidates(self):
+        """ Génère les triplets (score, mot-clé, phrase) du meilleur
+        au moins bon score (à score égal, par mot-clé décroissant, comme
+        un tri décroissant des triplets), en cherchant la phrase de chaque
+        mot-clé au fur et à mesure. Les triplets déjà trouvés sont gardés
+        dans candidate_triples.
+        """
+        yield from list(self.candidate_triples)
+
+        heap = self.candidate_heap
+        while heap:
+            # les candidats de même score sortent ensemble
+            neg_score, idx = heapq.heappop(heap)
+            tied = [idx]
+            while heap and heap[0][0] == neg_score:
+                tied.append(heapq.heappop(heap)[1])
+            tied.sort(key=lambda i: self.candidate_keywords[i], reverse=True)
+
+            done = 0
+            try:
+                for idx in tied:
+                    done += 1
+                    keyword = self.candidate_keywords[idx]
+                    sentence = self.get_corresponding_sentence_for_keyword(
+                        keyword, self.candidate_words[idx])
+                    if sentence:  # Seulement ajouter si une phrase correspondante est trouvée
+                        triple = [-neg_score, keyword, sentence]
+                        self.candidate_triples.append(triple)
+                        yield triple
+            finally:
+                # arrêt anticipé : remettre les candidats pas encore vus dans le tas
+                for idx in tied[done:]:
+                    heapq.heappush(heap, (neg_score, idx))
 
     def form_questions(self):
         ''' Forms the question and populates
         the question dict with improved formatting
         '''
-        used_sentences = list()
-        idx = 0
+        for number, question in self.iter_formed_questions():
+            self.questions_dict[number] = question
+
+    def iter_formed_questions(self):
+        ''' Forms the questions of the ranked candidates
+        one at a time, stopping after 'num_questions' questions
+        '''
+        if self.num_questions < 1:
+            return
+
+        used_sentences = set()
         cntr = 1
-        num_candidates = len(self.candidate_triples)
 
-        while cntr <= self.num_questions and idx < num_candidates:
-            candidate_triple = self.candidate_triples[idx]
+        for candidate_triple in self.iter_ranked_candidates():
             sentence = candidate_triple[2]
             keyword = candidate_triple[1]
 
             if sentence not in used_sentences and sentence.strip():
-                used_sentences.append(sentence)
+                used_sentences.add(sentence)
 
                 # Amélioration : génération de question plus naturelle
                 question_text = self.create_better_question(sentence, keyword)
 
-                self.questions_dict[cntr] = {
+                yield cntr, {
                     "question": question_text,
                     "answer": keyword
                 }
+                if cntr == self.num_questions:
+                    return
                 cntr += 1
-            idx += 1
 
     def create_better_question(self, sentence, keyword):
         '''Crée une question plus naturelle'''
@@ -3,80 +3,281 @@ et de génération de réponses incorrectes
 """
 from question_extraction import QuestionExtractor
 from incorrect_answer_generation import IncorrectAnswerGenerator
+from preprocessing import PreprocessedDocument
+from instrumentation import stage
+import multiprocessing
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from nltk import sent_tokenize
 
+# caractères supprimés par clean_text (la ponctuation essentielle est gardée)
+UNWANTED_CHARS = re.compile(r'[^\s\w\.\?\!\,\;\:]')
+MULTIPLE_SPACES = re.compile(' +')
+
+# QuestionGeneration d'un processus du pool de generate_questions_batch
+_batch_generation = None
+
 
 class QuestionGeneration:
     """Cette classe contient la méthode pour générer des questions"""
 
-    def __init__(self, num_questions, num_options):
+    def __init__(self, num_questions, num_options, corpus=None):
         self.num_questions = num_questions
         self.num_options = num_options
-        self.question_extractor = QuestionExtractor(num_questions)
+        # corpus : corpus.CorpusStatistics du mode corpus (voir corpus.py), ou None
+        self.question_extractor = QuestionExtractor(num_questions, corpus)
 
     def clean_text(self, text):
-        '''Nettoie le texte en préservant la ponctuation essentielle'''
+        '''Nettoie le texte en préservant la ponctuation essentielle.
+        Chaque phrase finit par un point ; le texte est construit en une
+        liste de morceaux joints à la fin (temps linéaire)'''
         text = text.replace('\n', ' ')  # supprimer les retours à la ligne
-        sentences = sent_tokenize(text)
-        cleaned_text = ""
+        parts = []
 
-        for sentence in sentences:
+        for sentence in sent_tokenize(text):
             # AMÉLIORATION : préserver la ponctuation importante
-            cleaned_sentence = re.sub(r'[^\s\w\.\?\!\,\;\:]', '', sentence)
+            cleaned_sentence = UNWANTED_CHARS.sub('', sentence)
             # substituer les espaces multiples par un seul espace
-            cleaned_sentence = re.sub(' +', ' ', cleaned_sentence)
-            cleaned_text += cleaned_sentence
+            cleaned_sentence = MULTIPLE_SPACES.sub(' ', cleaned_sentence)
+
+            # l'espace final (de la phrase, ou de la précédente si elle est vide)
+            # est remplacé par le point
+            if cleaned_sentence.endswith(' '):
+                cleaned_sentence = cleaned_sentence[:-1]
+            elif not cleaned_sentence and parts:
+                parts.pop()
+            parts.extend((cleaned_sentence, '.', ' '))
 
-            # CORRECTION du bug : impossible d'assigner à un caractère de string
-            if cleaned_text.endswith(' '):
-                cleaned_text = cleaned_text[:-1] + '.'
-            else:
-                cleaned_text += '.'
+        return ''.join(parts).strip()  # supprimer les espaces en début/fin
 
-            cleaned_text += ' '  # ajouter un espace à la fin
+    def preprocess(self, document):
+        """Nettoie le document puis le découpe, une seule fois, en phrases et en mots
+        pour toutes les étapes suivantes"""
+        with stage('clean_text'):
+            text = self.clean_text(document)
+        with stage('tokenize'):
+            return PreprocessedDocument(text, self.question_extractor.stop_words)
 
-        return cleaned_text.strip()  # supprimer les espaces en début/fin
+    def generate_questions_dict(self, document, entities=None):
+        """Génère un dictionnaire de questions à partir d'un document
 
-    def generate_questions_dict(self, document):
-        """Génère un dictionnaire de questions à partir d'un document"""
+        Params:
+            * document : string, ou PreprocessedDocument déjà nettoyé et découpé
+            * entities : list<str>, entités déjà extraites (mode batch)
+        """
         try:
             # Validation du document d'entrée
-            if not document or not document.strip():
+            text = document.text if isinstance(document, PreprocessedDocument) else document
+            if not text or not text.strip():
                 print("Erreur : Document vide ou invalide")
                 return {}
 
-            document = self.clean_text(document)
-            self.questions_dict = self.question_extractor.get_questions_dict(document)
+            if not isinstance(document, PreprocessedDocument):
+                document = self.preprocess(document)
+            self.questions_dict = self.question_extractor.get_questions_dict(document, entities)
 
             if not self.questions_dict:
                 print("Aucune question générée à partir du document")
                 return {}
 
-            self.incorrect_answer_generator = IncorrectAnswerGenerator(document)
-
-            for i in range(1, self.num_questions + 1):
-                if i not in self.questions_dict:
-                    continue
+            with stage('distractors'):
+                self.incorrect_answer_generator = IncorrectAnswerGenerator(document)
+                # distracteurs de toutes les réponses du quiz en une seule requête
+                self.incorrect_answer_generator.prefetch_options(
+                    [question["answer"] for question in self.questions_dict.values()],
+                    self.num_options)
 
-                try:
-                    self.questions_dict[i]["options"] = \
-                        self.incorrect_answer_generator.get_all_options_dict(
-                            self.questions_dict[i]["answer"],
-                            self.num_options
-                        )
-                except Exception as e:
-                    print(f"Erreur lors de la génération des options pour la question {i}: {e}")
-                    # Créer des options par défaut en cas d'erreur
-                    self.questions_dict[i]["options"] = {
-                        1: self.questions_dict[i]["answer"],
-                        2: "Option 2",
-                        3: "Option 3",
-                        4: "Option 4"
-                    }
+                for i in range(1, self.num_questions + 1):
+                    if i not in self.questions_dict:
+                        continue
+                    self.questions_dict[i]["options"] = self.get_options(i, self.questions_dict[i]["answer"])
 
             return self.questions_dict
 
         except Exception as e:
             print(f"Erreur lors de la génération des questions : {e}")
-            return {}
\ No newline at end of file
+            return {}
+
+    def iter_questions(self, document, entities=None):
+        """Génère les questions une à une, avec leurs options, dès qu'elles sont prêtes :
+        la première arrive après l'extraction, la NER et la recherche de ses seuls
+        distracteurs ; les distracteurs de toutes les suivantes sont ensuite résolus
+        en un seul lot (voir iter_options). La génération s'arrête après
+        'num_questions' questions, ou dès que l'appelant ferme le générateur.
+
+        Params:
+            * document : string, ou PreprocessedDocument déjà nettoyé et découpé
+            * entities : list<str>, entités déjà extraites (mode batch)
+        Yields:
+            * (numéro, {question, answer, options})
+        """
+        try:
+            text = document.text if isinstance(document, PreprocessedDocument) else document
+            if not text or not text.strip():
+                print("Erreur : Document vide ou invalide")
+                return
+
+            if not isinstance(document, PreprocessedDocument):
+                document = self.preprocess(document)
+            self.questions_dict = dict()
+
+            yield from self.iter_options(
+                document, self.question_extractor.iter_questions(document, entities))
+
+        except Exception as e:
+            print(f"Erreur lors de la génération des questions : {e}")
+
+    def iter_options(self, document, questions):
+        """Ajoute leurs options aux questions (numéro, question) d'un document.
+
+        La première question est envoyée dès que ses distracteurs sont trouvés ;
+        les questions suivantes sont alors toutes formées (le classement est peu
+        coûteux) et leurs distracteurs résolus en un seul appel à prefetch_options
+        (une requête groupée au modèle, un produit par lots avec le vocabulaire).
+        """
+        self.incorrect_answer_generator = None
+        first = next(questions, None)
+        if first is None:
+            return
+
+        with stage('distractors', accumulate=True):
+            self.incorrect_answer_generator = IncorrectAnswerGenerator(document)
+            self.incorrect_answer_generator.prefetch_options([first[1]["answer"]], self.num_options)
+        yield self.add_options(*first)
+
+        remaining = list(questions)
+        with stage('distractors', accumulate=True):
+            self.incorrect_answer_generator.prefetch_options(
+                [question["answer"] for _, question in remaining], self.num_options)
+        for number, question in remaining:
+            yield self.add_options(number, question)
+
+    def add_options(self, number, question):
+        """Ajoute ses options (déjà résolues) à une question et la garde dans questions_dict"""
+        with stage('distractors', accumulate=True):
+            question["options"] = self.get_options(number, question["answer"])
+        self.questions_dict[number] = question
+        return number, question
+
+    def get_options(self, number, answer):
+        """Retourne le dict des options de la question 'number' (options par défaut en cas d'erreur)"""
+        try:
+            return self.incorrect_answer_generator.get_all_options_dict(answer, self.num_options)
+        except Exception as e:
+            print(f"Erreur lors de la génération des options pour la question {number}: {e}")
+            # Créer des options par défaut en cas d'erreur
+            return {
+                1: answer,
+                2: "Option 2",
+                3: "Option 3",
+                4: "Option 4"
+            }
+
+    def generate_questions_batch(self, documents, batch_size=4, n_process=1, n_workers=1):
+        """Génère les questions de plusieurs documents en un seul passage de spacy.
+
+        Les documents sont découpés puis analysés par nlp.pipe (par lots,
+        éventuellement sur plusieurs processus). Avec 'n_workers' > 1, la suite
+        (TF-IDF, classement, distracteurs) de chaque document tourne sur un pool
+        de processus pendant que spacy analyse les documents suivants.
+
+        Params:
+            * documents : itérable de paires (clé, texte)
+            * batch_size : nombre de morceaux de texte par lot spacy
+            * n_process : nombre de processus spacy
+            * n_workers : nombre de processus pour les étapes après la NER
+        Yields:
+            * (clé, dict de questions), dans l'ordre des documents
+        """
+        # documents en cours d'analyse, dans l'ordre : nlp.pipe lit en avance
+        # mais rend les documents dans l'ordre (une clé peut apparaître deux fois)
+        preprocessed = deque()
+
+        def preprocessed_documents():
+            for key, text in documents:
+                document = self.preprocess(text) if text and text.strip() else None
+                preprocessed.append(document)
+                yield key, document.sentences if document else []
+
+        entities_batch = self.question_extractor.iter_entities_batch(
+            preprocessed_documents(), batch_size, n_process)
+
+        if n_workers <= 1:
+            for key, entities in entities_batch:
+                document = preprocessed.popleft()
+                if document is None:
+                    yield key, {}
+                    continue
+                yield key, self.generate_questions_dict(document, entities)
+            return
+
+        corpus = self.question_extractor.corpus
+        # processus démarrés par 'spawn' (voir workers.pool_pdf) ; ils ne chargent
+        # que GloVe, les entités leur sont envoyées avec le document
+        with ProcessPoolExecutor(
+                max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_batch_worker,
+                initargs=(self.num_questions, self.num_options,
+                          corpus.path if corpus is not None else None)) as pool:
+            # au plus deux documents en attente par processus, rendus dans l'ordre
+            pending = deque()
+            for key, entities in entities_batch:
+                document = preprocessed.popleft()
+                future = pool.submit(_generate_batch_document, document, entities) if document else None
+                pending.append((key, future))
+                while len(pending) > 2 * n_workers:
+                    yield _batch_result(*pending.popleft())
+            while pending:
+                yield _batch_result(*pending.popleft())
+
+    def generate_questions_from_files(self, paths, batch_size=4, n_process=1, n_workers=1):
+        """Génère les questions de chaque fichier PDF/TXT d'une liste
+        de fichiers et/ou de dossiers (parcourus récursivement).
+
+        Yields:
+            * (chemin, dict de questions avec la liste des options)
+        """
+        from workers import lire_document, formater_options
+
+        def read_documents():
+            for path in iter_document_paths(paths):
+                yield path, lire_document(path, path.rsplit('.', 1)[1])
+
+        for path, questions in self.generate_questions_batch(
+                read_documents(), batch_size, n_process, n_workers):
+            yield path, formater_options(questions)
+
+
+def _init_batch_worker(num_questions, num_options, corpus_path):
+    """Crée la QuestionGeneration d'un processus du pool de generate_questions_batch"""
+    global _batch_generation
+    corpus = None
+    if corpus_path:
+        from corpus import CorpusStatistics
+        corpus = CorpusStatistics(corpus_path)
+    _batch_generation = QuestionGeneration(num_questions, num_options, corpus)
+
+
+def _generate_batch_document(document, entities):
+    """Étapes après la NER d'un document, exécutées dans un processus du pool"""
+    return _batch_generation.generate_questions_dict(document, entities)
+
+
+def _batch_result(key, future):
+    return key, future.result() if future is not None else {}
+
+
+def iter_document_paths(paths, extensions=('pdf', 'txt')):
+    """Génère les fichiers PDF/TXT d'une liste de fichiers et de dossiers"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.rsplit('.', 1)[-1].lower() in extensions:
+                        yield os.path.join(root, name)
+        elif path.rsplit('.', 1)[-1].lower() in extensions:
+            yield path
+        else:
+            print(f"[TYPE ERROR] Unsupported format: {path}")
@@ -0,0 +1,226 @@
+''' This module contains the content-addressed
+cache of the generated quizzes.
+
+A quiz is keyed by the hash of the uploaded bytes, the
+number of questions and options, the model versions and
+the scoring settings (corpus mode, GloVe ANN index), so a repeated upload of the same course is served without
+running the NLP pipeline again.
+'''
+import copy
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import corpus
+import glove_store
+from model_registry import model_versions
+
+CACHE_BACKEND = os.environ.get('QUIZ_CACHE_BACKEND', 'memory')
+CACHE_SIZE = int(os.environ.get('QUIZ_CACHE_SIZE', 256))
+CACHE_TTL = float(os.environ.get('QUIZ_CACHE_TTL', 24 * 3600))
+CACHE_PATH = os.environ.get('QUIZ_CACHE_PATH', os.path.join('.', 'cache', 'quizzes.sqlite'))
+
+# bump when the format of the generated quizzes changes
+CACHE_FORMAT = 1
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    ''' Returns the sha256 of a file, read by chunks '''
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MemoryBackend:
+    ''' In-process LRU store with a maximum number
+    of entries and an optional time to live. Without
+    'refresh_on_read', the entries are evicted in the
+    order they were written
+    '''
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, refresh_on_read=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh_on_read = refresh_on_read
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            if self.refresh_on_read:
+                self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteBackend:
+    ''' On-disk store shared by every worker process,
+    evicting expired entries then the least recently used ones.
+    Without 'refresh_on_read', a lookup is a plain read (it
+    never takes the write lock of the database): the entries
+    are evicted in the order they were written, and the
+    expired ones are deleted by the next write
+    '''
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_SIZE, ttl=CACHE_TTL,
+                 refresh_on_read=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh_on_read = refresh_on_read
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # readers do not wait for the writers of the other processes
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                ' key TEXT PRIMARY KEY,'
+                ' value BLOB NOT NULL,'
+                ' expires_at REAL,'
+                ' accessed_at REAL NOT NULL)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+
+    def get(self, key):
+        now = time.time()
+        if not self.refresh_on_read:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT value FROM entries WHERE key = ?'
+                    ' AND (expires_at IS NULL OR expires_at >= ?)', (key, now)).fetchone()
+            return pickle.loads(row[0]) if row is not None else None
+
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] < now:
+                self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            self._conn.execute(
+                'UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                (key, pickle.dumps(value), expires_at, now))
+            self._conn.execute(
+                'DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?', (now,))
+            self._conn.execute(
+                'DELETE FROM entries WHERE key NOT IN '
+                '(SELECT key FROM entries ORDER BY accessed_at DESC LIMIT ?)',
+                (self.max_entries,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+class QuizCache:
+    ''' This class wraps a backend with the
+    cache key computation and hit/miss counters
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(digest, num_questions, num_options):
+        ''' Returns the cache key of a document given
+        the sha256 of its bytes
+        '''
+        parts = [digest, str(num_questions), str(num_options), str(CACHE_FORMAT)]
+        parts.extend(model_versions())
+        parts.append(f"ann={int(glove_store.USE_ANN)}")
+        parts.extend(QuizCache.corpus_state(digest))
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def corpus_state(digest):
+        ''' Returns the corpus mode and the number of documents
+        of the corpus the document is scored against: a quiz
+        is generated again once the corpus has changed
+        '''
+        statistics = corpus.corpus_statistics
+        if statistics is None:
+            return ['corpus=off']
+        num_documents = statistics.num_documents
+        # the upload is added to the corpus before being scored
+        if corpus.CORPUS_UPDATE and digest not in statistics:
+            num_documents += 1
+        return [f"corpus={statistics.path}", str(num_documents)]
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'entries': len(self.backend) if self.backend is not None else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def create_cache(backend=CACHE_BACKEND):
+    ''' Builds the cache selected by QUIZ_CACHE_BACKEND
+    ('memory', 'sqlite' or 'none')
+    '''
+    if backend == 'memory':
+        return QuizCache(MemoryBackend())
+    if backend == 'sqlite':
+        return QuizCache(SqliteBackend())
+    if backend == 'none':
+        return QuizCache(None)
+    raise ValueError(f"Unknown quiz cache backend: {backend}")
+
+
+quiz_cache = create_cache()
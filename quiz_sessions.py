@@ -0,0 +1,91 @@
+''' This module contains the server-side store of the
+served quizzes, used to grade the submitted answers.
+
+A quiz is kept under its id as its answer key only: one
+byte per question, the index of its correct option. /result
+grades a submission from it in O(questions), without the
+questions themselves or any model.
+'''
+import os
+import threading
+
+from quiz_cache import MemoryBackend, SqliteBackend
+
+SESSION_BACKEND = os.environ.get('QUIZ_SESSION_BACKEND', 'memory')
+SESSION_SIZE = int(os.environ.get('QUIZ_SESSION_SIZE', 10000))
+SESSION_TTL = float(os.environ.get('QUIZ_SESSION_TTL', 24 * 3600))
+SESSION_PATH = os.environ.get('QUIZ_SESSION_PATH', os.path.join('.', 'cache', 'sessions.sqlite'))
+
+
+def answer_key(questions):
+    ''' Returns the answer key of a quiz: byte i is the
+    index (from 1) of the correct option of question i + 1,
+    0 when the answer is not among the options
+    '''
+    key = bytearray(len(questions))
+    for number, question in questions.items():
+        options = list(question.get('options') or [])
+        if question.get('answer') in options and 1 <= number <= len(key):
+            key[number - 1] = min(options.index(question['answer']) + 1, 255)
+    return bytes(key)
+
+
+class QuizSessions:
+    ''' This class wraps a backend with the
+    storage and the grading of the quizzes
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.graded = 0
+        self.unknown = 0
+        self._lock = threading.Lock()
+
+    def save(self, quiz_id, questions):
+        ''' Keeps the answer key of a generated quiz '''
+        if questions:
+            self.backend.set(quiz_id, answer_key(questions))
+
+    def grade(self, quiz_id, answers):
+        ''' Returns (correct answers, number of questions) of
+        a submission, or None if the quiz is unknown or expired.
+        'answers' maps 'question<number>' to the index of the chosen option.
+        '''
+        key = self.backend.get(quiz_id) if quiz_id else None
+        with self._lock:
+            if key is None:
+                self.unknown += 1
+            else:
+                self.graded += 1
+        if key is None:
+            return None
+
+        correct = 0
+        for number, option in enumerate(key, 1):
+            if option and answers.get(f'question{number}') == str(option):
+                correct += 1
+        return correct, len(key)
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'graded': self.graded,
+            'unknown': self.unknown,
+        }
+
+
+def create_sessions(backend=SESSION_BACKEND):
+    ''' Builds the store selected by QUIZ_SESSION_BACKEND
+    ('memory' or 'sqlite')
+    '''
+    # grading only reads: the oldest quizzes are evicted first
+    if backend == 'memory':
+        return QuizSessions(MemoryBackend(SESSION_SIZE, SESSION_TTL, refresh_on_read=False))
+    if backend == 'sqlite':
+        return QuizSessions(SqliteBackend(SESSION_PATH, SESSION_SIZE, SESSION_TTL,
+                                          refresh_on_read=False))
+    raise ValueError(f"Unknown quiz session backend: {backend}")
+
+
+quiz_sessions = create_sessions()
@@ -0,0 +1,110 @@
+''' This module contains the handling of the uploaded
+documents.
+
+Werkzeug writes each uploaded file straight into a unique
+file of the upload folder (no buffering of the whole body,
+no copy afterwards) and its sha256 is computed on the way,
+so the quiz cache does not read the file a second time.
+The file is removed once its quiz is generated, or at the
+end of the request when no job took it. The size of a request
+and the number of uploads received at once are bounded.
+'''
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from flask import Request
+
+UPLOAD_FOLDER = os.environ.get('QUIZ_UPLOAD_DIR', os.path.join('.', 'pdf'))
+MAX_UPLOAD_BYTES = int(os.environ.get('QUIZ_MAX_UPLOAD_BYTES', 16 * 1024 * 1024))
+# uploads received at the same time by a worker process
+MAX_INFLIGHT_UPLOADS = int(os.environ.get('QUIZ_MAX_INFLIGHT_UPLOADS', 4))
+# files left behind by a crashed process are removed after this many seconds
+STALE_UPLOAD_SECONDS = float(os.environ.get('QUIZ_STALE_UPLOAD_SECONDS', 24 * 3600))
+UPLOAD_PREFIX = 'quizzet-'
+
+upload_slots = threading.BoundedSemaphore(MAX_INFLIGHT_UPLOADS)
+
+
+class UploadFile:
+    ''' This class is a unique file of the upload folder
+    that hashes the bytes written to it
+    '''
+
+    def __init__(self, suffix='', directory=UPLOAD_FOLDER):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix=UPLOAD_PREFIX, suffix=suffix, dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        # set once a job is in charge of removing the file
+        self.handed_over = False
+
+    def write(self, data):
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def remove(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __getattr__(self, name):
+        # read, seek, close... of the underlying file
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    ''' Request whose uploaded files are written
+    into UploadFile instances
+    '''
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        extension = os.path.splitext(filename or '')[1].lower()
+        if not extension[1:].isalnum():
+            extension = ''
+        upload = UploadFile(extension)
+        self.upload_files.append(upload)
+        return upload
+
+    @property
+    def upload_files(self):
+        files = self.__dict__.get('_upload_files')
+        if files is None:
+            files = self.__dict__['_upload_files'] = []
+        return files
+
+    def remove_uploads(self):
+        ''' Removes the files of the request not handed over to a job '''
+        for upload in self.upload_files:
+            if not upload.handed_over:
+                upload.remove()
+
+
+def upload_of(file_storage):
+    ''' Returns the UploadFile of an uploaded file, or None '''
+    stream = file_storage.stream
+    return stream if isinstance(stream, UploadFile) else None
+
+
+def remove_stale_uploads(directory=UPLOAD_FOLDER, max_age=STALE_UPLOAD_SECONDS):
+    ''' Removes the uploads left behind by a process that
+    stopped before their quiz was generated
+    '''
+    if not os.path.isdir(directory):
+        return
+    limit = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if name.startswith(UPLOAD_PREFIX) and os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError as e:
+            print(f"[UPLOAD ERROR] Unable to remove {path}: {e}")
@@ -2,52 +2,145 @@
 Module workers.py — Lecture de fichier & génération de questions avec gestion robuste des erreurs
 """
 
-try:
-    from PyPDF2 import PdfReader  # Version récente
-except ImportError:
+from quiz_cache import quiz_cache, file_digest
+from instrumentation import trace_pipeline, stage
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import multiprocessing
+import os
+import sqlite3
+import threading
+
+# Limites de lecture des PDF, pour qu'un énorme fichier ne bloque pas un worker
+PDF_PAGE_LIMIT = int(os.environ.get('QUIZ_PDF_PAGE_LIMIT', 500))
+PDF_BYTE_BUDGET = int(os.environ.get('QUIZ_PDF_BYTE_BUDGET', 5 * 1024 * 1024))
+# Au-delà de ce nombre de pages, l'extraction est répartie sur plusieurs processus
+PDF_PARALLEL_PAGES = int(os.environ.get('QUIZ_PDF_PARALLEL_PAGES', 64))
+PDF_BATCH_PAGES = 16
+PDF_WORKERS = int(os.environ.get('QUIZ_PDF_WORKERS', os.cpu_count() or 1))
+
+_pool_pdf = None
+_pool_pdf_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _pdf_reader():
+    """Importe PyPDF2 à la première lecture d'un PDF, pas au chargement du module."""
     try:
-        from PyPDF2 import PdfFileReader as PdfReader  # Version ancienne
+        from PyPDF2 import PdfReader  # Version récente
     except ImportError:
-        print("[IMPORT ERROR] The PyPDF2 module was not found.\n"
-                    " Please install it with the command: pip install PyPDF2")
-        raise
+        try:
+            from PyPDF2 import PdfFileReader as PdfReader  # Version ancienne
+        except ImportError:
+            print("[IMPORT ERROR] The PyPDF2 module was not found.\n"
+                        " Please install it with the command: pip install PyPDF2")
+            raise
+    return PdfReader
 
-from question_generation_main import QuestionGeneration
 
+def charger_pipeline():
+    """Importe à l'avance les modules du pipeline (nltk, sklearn, PyPDF2...),
+    sinon chargés au premier quiz généré (préchauffage de app.py).
+    """
+    _pdf_reader()
+    import question_generation_main  # noqa: F401
 
-def generer_questions(file_path: str, file_exten: str, n=8, o=5) -> dict: # modif robin
-    """Lit un fichier PDF ou TXT, extrait son contenu et génère des questions à choix multiples."""
 
-    if not file_path:
-        print("[ERROR] No file path provided.")
-        return {}
+def _texte_page(page, idx):
+    """Extrait le texte d'une page, compatible avec les anciennes versions de PyPDF2."""
+    try:
+        if hasattr(page, 'extract_text'):
+            return page.extract_text() or ''
+        return page.extractText() or ''
+    except Exception as e:
+        print(f"[PDF - Page {idx}] Failed to extract text: {e}")
+        return ''
+
+
+def _extraire_pages(file_path, start, stop):
+    """Extrait le texte des pages [start, stop) — exécuté dans un processus du pool."""
+    with open(file_path, 'rb') as pdf_file:
+        reader = _pdf_reader()(pdf_file)
+        return [_texte_page(reader.pages[p], p) for p in range(start, stop)]
+
+
+def pool_pdf():
+    """Retourne le pool de processus partagé par toutes les extractions de PDF
+    (au plus PDF_WORKERS processus pour tout le processus).
+
+    Les processus sont démarrés par 'spawn' : un fork du processus de l'app,
+    qui a plusieurs threads (jobs, Flask, distracteurs), peut copier un verrou
+    tenu par un autre thread et bloquer l'enfant.
+    """
+    global _pool_pdf
+    with _pool_pdf_lock:
+        if _pool_pdf is None:
+            _pool_pdf = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool_pdf
+
+
+def iter_pages_pdf(file_path, page_limit=PDF_PAGE_LIMIT,
+                   parallel_pages=PDF_PARALLEL_PAGES, max_workers=PDF_WORKERS):
+    """Génère le texte des pages d'un PDF, dans l'ordre, au fur et à mesure.
 
+    Les gros PDF sont découpés en lots de pages extraits par le pool de processus
+    partagé (pool_pdf).
+    """
+    with open(file_path, 'rb') as pdf_file:
+        reader = _pdf_reader()(pdf_file)
+        num_pages = min(len(reader.pages), page_limit)
+
+        if num_pages < parallel_pages or max_workers < 2:
+            for p in range(num_pages):
+                yield _texte_page(reader.pages[p], p)
+            return
+
+    executor = pool_pdf()
+    futures = [
+        executor.submit(_extraire_pages, file_path, start,
+                        min(start + PDF_BATCH_PAGES, num_pages))
+        for start in range(0, num_pages, PDF_BATCH_PAGES)
+    ]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        # arrêt anticipé (budget atteint) : annuler les lots restants
+        for future in futures:
+            future.cancel()
+
+
+def extraire_texte_pdf(file_path, page_limit=PDF_PAGE_LIMIT, byte_budget=PDF_BYTE_BUDGET):
+    """Lit un PDF page par page et retourne son texte, joint en une seule fois.
+
+    La lecture s'arrête après 'page_limit' pages ou 'byte_budget' octets de texte.
+    """
+    pages = []
+    size = 0
+    for text in iter_pages_pdf(file_path, page_limit):
+        text_size = len(text.encode('utf-8'))
+        if size + text_size > byte_budget:
+            print(f"[PDF] Text budget of {byte_budget} bytes reached, "
+                  f"stopping after {len(pages)} pages")
+            break
+        pages.append(text)
+        size += text_size
+    return ''.join(pages)
+
+
+def lire_document(file_path: str, file_exten: str) -> str:
+    """Lit un fichier PDF ou TXT et retourne son texte ('' en cas d'erreur)."""
     content = ''
 
     # Lecture du fichier
     try:
         if file_exten.lower() == 'pdf':
             try:
-                with open(file_path, 'rb') as pdf_file:
-                    try:
-                        from PyPDF2 import PdfFileReader
-                        reader = PdfFileReader(pdf_file)
-                        for p in range(reader.numPages):
-                            try:
-                                content += reader.getPage(p).extractText()
-                            except Exception as e:
-                                print(f"[PDF - Page {p}] Failed to extract text: {e}")
-                    except ImportError:
-                        from PyPDF2 import PdfReader
-                        reader = PdfReader(pdf_file)
-                        for idx, page in enumerate(reader.pages):
-                            try:
-                                content += page.extract_text()
-                            except Exception as e:
-                                print(f"[PDF - Page {idx}] Failed to extract text: {e}")
+                content = extraire_texte_pdf(file_path)
             except Exception as e:
                 print(f"[PDF OPENING ERROR] {e}")
-                return {}
+                return ''
 
         elif file_exten.lower() == 'txt':
             try:
@@ -59,34 +152,147 @@ def generer_questions(file_path: str, file_exten: str, n=8, o=5) -> dict: # modi
                         content = txt_file.read()
                 except Exception as e:
                     print(f"[TXT ERROR - Alternative Encoding] {e}")
-                    return {}
+                    return ''
             except Exception as e:
                 print(f"[ERROR TXT] {e}")
-                return {}
+                return ''
         else:
             print(f"[TYPE ERROR] Unsupported format: {file_exten}")
-            return {}
+            return ''
 
     except Exception as e:
         print(f"[FILE ERROR] Problem reading the file : {e}")
-        return {}
+        return ''
+
+    return content
+
+
+def formater_options(q: dict) -> dict:
+    """Remplace le dict des options de chaque question par la liste ordonnée des options."""
+    for key in q:
+        if 'options' in q[key] and isinstance(q[key]['options'], dict):
+            q[key]['options'] = [q[key]['options'][j] for j in sorted(q[key]['options']) if j in q[key]['options']]
+    return q
+
+
+def generer_questions(file_path: str, file_exten: str, n=8, o=5, profile=False) -> dict: # modif robin
+    """Lit un fichier PDF ou TXT, extrait son contenu et génère des questions à choix multiples.
+
+    Chaque appel est mesuré étape par étape (voir instrumentation.py) ;
+    'profile' active en plus cProfile et tracemalloc pour cet appel.
+    """
+    with trace_pipeline('generer_questions', profile):
+        return _generer_questions(file_path, file_exten, n, o)
+
+
+def generer_questions_stream(file_path: str, file_exten: str, n=8, o=5, profile=False,
+                             digest=None, supprimer_fichier=False):
+    """Comme generer_questions, mais génère chaque question (numéro, question)
+    dès qu'elle est prête, pour l'envoyer au navigateur sans attendre la fin du quiz.
+
+    Le quiz n'est mis en cache que s'il a été généré jusqu'au bout.
+    'digest' est le sha256 du fichier s'il est déjà connu (calculé pendant
+    l'upload) ; avec 'supprimer_fichier', le fichier est supprimé à la fin.
+    """
+    try:
+        with trace_pipeline('generer_questions', profile):
+            yield from _iter_questions(file_path, file_exten, n, o, digest)
+    finally:
+        if supprimer_fichier:
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                print(f"[FILE ERROR] Unable to remove {file_path}: {e}")
+
+
+def _lire_avec_cache(file_path: str, file_exten: str, n: int, o: int, digest=None):
+    """Retourne (clé de cache, quiz en cache, texte du document, sha256 du fichier) ;
+    le document n'est pas lu quand le quiz est en cache."""
+    # Un document déjà traité avec les mêmes paramètres est servi depuis le cache
+    with stage('cache_lookup'):
+        try:
+            digest = digest or file_digest(file_path)
+            cache_key = quiz_cache.make_key(digest, n, o)
+            cached = quiz_cache.get(cache_key)
+        except OSError as e:
+            print(f"[CACHE ERROR] {e}")
+            cache_key, cached = None, None
+    if cached:
+        return cache_key, cached, '', digest
+
+    with stage('extract_text'):
+        content = lire_document(file_path, file_exten)
 
     # Vérification du contenu
     if not content.strip():
         print("[CONTENT ERROR] No readable content found in the file.")
+    return cache_key, None, content, digest
+
+
+def _corpus_du_document(digest, content):
+    """Retourne le corpus du mode corpus (None s'il est désactivé), après y avoir
+    ajouté le document quand QUIZ_CORPUS_UPDATE est actif : le document est
+    pondéré par l'IDF d'un corpus qui le contient, sans rien réajuster."""
+    from corpus import CORPUS_UPDATE, corpus_statistics
+    if corpus_statistics is not None and CORPUS_UPDATE and digest:
+        with stage('corpus_update'):
+            try:
+                corpus_statistics.add_document(digest, content)
+            except sqlite3.Error as e:
+                print(f"[CORPUS ERROR] {e}")
+    return corpus_statistics
+
+
+def _generer_questions(file_path: str, file_exten: str, n: int, o: int) -> dict:
+    if not file_path:
+        print("[ERROR] No file path provided.")
         return {}
+
+    cache_key, cached, content, digest = _lire_avec_cache(file_path, file_exten, n, o)
+    if cached:
+        return cached
+    if not content.strip():
+        return {}
+
     # Génération des questions
     try:
-        qGen = QuestionGeneration(n, o)
-        q = qGen.generate_questions_dict(content)
-
-        # Reformater les options
-        for key in q:
-            if 'options' in q[key] and isinstance(q[key]['options'], dict):
-                q[key]['options'] = [q[key]['options'][j] for j in sorted(q[key]['options']) if j in q[key]['options']]
+        from question_generation_main import QuestionGeneration
+        qGen = QuestionGeneration(n, o, _corpus_du_document(digest, content))
+        q = formater_options(qGen.generate_questions_dict(content))
 
+        if q and cache_key:
+            quiz_cache.set(cache_key, q)
         return q
 
     except Exception as e:
         print(f"[ERROR QUESTIONS] Unable to generate questions : {e}")
         return {}
+
+
+def _iter_questions(file_path: str, file_exten: str, n: int, o: int, digest=None):
+    if not file_path:
+        print("[ERROR] No file path provided.")
+        return
+
+    cache_key, cached, content, digest = _lire_avec_cache(file_path, file_exten, n, o, digest)
+    if cached:
+        yield from cached.items()
+        return
+    if not content.strip():
+        return
+
+    # Génération des questions, envoyées une à une
+    q = dict()
+    try:
+        from question_generation_main import QuestionGeneration
+        qGen = QuestionGeneration(n, o, _corpus_du_document(digest, content))
+        for number, question in qGen.iter_questions(content):
+            q[number] = formater_options({number: question})[number]
+            yield number, q[number]
+
+    except Exception as e:
+        print(f"[ERROR QUESTIONS] Unable to generate questions : {e}")
+        return
+
+    if q and cache_key:
+        quiz_cache.set(cache_key, q)